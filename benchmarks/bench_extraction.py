@@ -0,0 +1,229 @@
+"""
+Extraction benchmarks on the synthetic corpus (no network needed).
+
+    python -m benchmarks.bench_extraction                       # run, print table
+    python -m benchmarks.bench_extraction --save-baseline       # store results as the baseline
+    python -m benchmarks.bench_extraction --compare             # fail (exit 1) on regressions
+    python -m benchmarks.bench_extraction --cases jpeg_photos --targets extract_from_bytes
+
+Per case and target it reports the median wall time, throughput (MB/s of input PDF),
+images/s, the peak Python heap (tracemalloc) and the peak RSS growth, which also covers
+MuPDF's native allocations.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+# main.py opens a local store on import when Supabase isn't configured; keep it out of the tree
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="paperprism-bench-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+
+import main  # noqa: E402
+import sanitizer  # noqa: E402
+import utils  # noqa: E402
+from benchmarks.synthetic_pdfs import CORPUS, build_pdf  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.15  # Median time may grow 15% before it counts as a regression
+
+
+def _collect_only(pdf_bytes: bytes):
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return main._collect_pdf_images(doc)
+    finally:
+        doc.close()
+
+
+def _count_images(result) -> int:
+    if isinstance(result, dict):
+        return result.get("count", len(result.get("images", [])))
+    if isinstance(result, list):
+        return len(result)
+    return 0
+
+
+TARGETS: Dict[str, Callable[[bytes], object]] = {
+    "extract_from_bytes": main.extract_from_bytes,
+    "_collect_pdf_images": _collect_only,
+    "utils.extract_images_from_pdf_bytes": utils.extract_images_from_pdf_bytes,
+    # The tiers themselves: sanitizer.sanitize_pdf caches by input hash, so repeats would time the cache
+    "sanitizer.repair_pdf": sanitizer.repair_pdf,
+    "sanitizer.scrub_pdf": sanitizer.scrub_pdf,
+}
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class PeakRss:
+    """Polls RSS in a thread while the block runs; reports growth over the starting RSS."""
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+    @property
+    def growth(self) -> int:
+        return max(0, self.peak - self.start)
+
+
+def bench_one(fn: Callable[[bytes], object], pdf_bytes: bytes, repeat: int) -> Dict:
+    fn(pdf_bytes)  # Warm-up (imports, font caches)
+    times = []
+    images = 0
+    rss_growth = 0
+    for _ in range(repeat):
+        gc.collect()
+        with PeakRss() as rss:
+            start = time.perf_counter()
+            result = fn(pdf_bytes)
+            times.append(time.perf_counter() - start)
+        rss_growth = max(rss_growth, rss.growth)
+        images = _count_images(result)
+        del result
+
+    # Separate pass: tracemalloc slows allocation-heavy code, so it never overlaps the timed runs
+    gc.collect()
+    tracemalloc.start()
+    fn(pdf_bytes)
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = statistics.median(times)
+    return {
+        "median_s": round(median, 5),
+        "min_s": round(min(times), 5),
+        "mb_per_s": round(len(pdf_bytes) / 1e6 / median, 2) if median else None,
+        "images": images,
+        "images_per_s": round(images / median, 1) if median else None,
+        "py_peak_mb": round(py_peak / 1e6, 2),
+        "rss_growth_mb": round(rss_growth / 1e6, 2),
+    }
+
+
+def load_extra(directory: str) -> Dict[str, bytes]:
+    pdfs = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(".pdf"):
+            with open(os.path.join(directory, name), "rb") as f:
+                pdfs[f"extra:{name}"] = f.read()
+    return pdfs
+
+
+def run(case_names: Optional[List[str]], target_names: Optional[List[str]], repeat: int, extra: Optional[str]) -> Dict:
+    corpus = {c.name: c for c in CORPUS if not case_names or c.name in case_names}
+    pdfs = {name: build_pdf(case) for name, case in corpus.items()}
+    if extra:
+        pdfs.update(load_extra(extra))
+    targets = {n: fn for n, fn in TARGETS.items() if not target_names or n in target_names}
+
+    results = {"meta": {"python": sys.version.split()[0], "pymupdf": fitz.VersionBind, "repeat": repeat}, "cases": {}}
+    for case_name, pdf_bytes in pdfs.items():
+        case_result = {"pdf_mb": round(len(pdf_bytes) / 1e6, 3), "targets": {}}
+        for target_name, fn in targets.items():
+            case_result["targets"][target_name] = bench_one(fn, pdf_bytes, repeat)
+        results["cases"][case_name] = case_result
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Returns a line per case/target whose median time regressed past the tolerance."""
+    regressions = []
+    for case_name, case in results["cases"].items():
+        base_case = baseline.get("cases", {}).get(case_name)
+        if not base_case:
+            continue
+        for target_name, stats in case["targets"].items():
+            base = base_case["targets"].get(target_name)
+            if not base or not base.get("median_s"):
+                continue
+            ratio = stats["median_s"] / base["median_s"]
+            stats["vs_baseline"] = round(ratio, 3)
+            if ratio > 1 + tolerance:
+                regressions.append(f"{case_name} / {target_name}: {base['median_s']:.4f}s -> {stats['median_s']:.4f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def print_table(results: Dict):
+    header = f"{'case':<16} {'target':<38} {'median s':>9} {'MB/s':>8} {'img/s':>9} {'py MB':>7} {'rss MB':>7} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for case_name, case in results["cases"].items():
+        for target_name, s in case["targets"].items():
+            vs = f"{s['vs_baseline']:.2f}x" if "vs_baseline" in s else "-"
+            print(
+                f"{case_name[:16]:<16} {target_name:<38} {s['median_s']:>9.4f} {s['mb_per_s'] or 0:>8.1f} "
+                f"{s['images_per_s'] or 0:>9.1f} {s['py_peak_mb']:>7.1f} {s['rss_growth_mb']:>7.1f} {vs:>8}"
+            )
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="*", help="Subset of corpus cases")
+    parser.add_argument("--targets", nargs="*", choices=sorted(TARGETS), help="Subset of functions")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--extra", help="Directory of real PDFs to add to the corpus")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="Exit 1 if any median regresses past --tolerance")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.cases, args.targets, args.repeat, args.extra)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+        if args.compare:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,58 @@
+"""
+Validates pdf_link against the captured mirror pages and times the regex fast path
+against the BeautifulSoup parse it replaced.
+
+    python -m benchmarks.bench_pdf_link [--repeat 500] [extra.html ...]
+
+Exits 1 if the fast path and the full parse disagree on any page.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_link  # noqa: E402
+from benchmarks.standins import MIRROR_FIXTURES  # noqa: E402
+
+BASE_URL = "https://sci-hub.example"
+
+
+def _time_per_call(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="Extra mirror pages to check")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    failures = 0
+    print(f"{'page':<28} {'fast us':>9} {'soup us':>9} {'speedup':>8}  url")
+    for path in MIRROR_FIXTURES + args.pages:
+        with open(path, "rb") as f:
+            page = f.read()
+        markup = pdf_link._COMMENT.sub("", pdf_link._decode(page))
+        fast = pdf_link.find_pdf_url(page, BASE_URL, allow_fallback=False)
+        soup = pdf_link._soup_scan(markup)
+        soup = pdf_link.complete_url(soup.strip(), BASE_URL) if soup else None
+        if fast != soup:
+            failures += 1
+            print(f"MISMATCH {os.path.basename(path)}: fast={fast!r} soup={soup!r}")
+            continue
+        fast_s = _time_per_call(lambda: pdf_link.find_pdf_url(page, BASE_URL, allow_fallback=False), args.repeat)
+        soup_s = _time_per_call(lambda: pdf_link._soup_scan(pdf_link._decode(page)), max(1, args.repeat // 10))
+        print(f"{os.path.basename(path)[:28]:<28} {fast_s * 1e6:>9.1f} {soup_s * 1e6:>9.1f} {soup_s / fast_s:>7.1f}x  {fast}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,274 @@
+"""
+Offline end-to-end load test: local stand-ins for the mirrors, Crossref and Unpaywall,
+a uvicorn instance of the app pointed at them, and a driver for /api/process,
+/api/upload and /ws at fixed concurrency.
+
+    python -m benchmarks.loadtest                                  # all scenarios, defaults
+    python -m benchmarks.loadtest --scenarios process --concurrency 16 --requests 200 \\
+        --mirrors 4 --mirror-latency 0.3 --mirror-error-rate 0.2 --mirror-hang-rate 0.05
+    python -m benchmarks.loadtest --target http://127.0.0.1:7860   # drive an app you started
+                                                                   # (with SCIHUB_MIRRORS etc. set yourself)
+
+Reports count, errors, throughput and p50/p95/p99 latency per scenario.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standins import (  # noqa: E402
+    MIRROR_FIXTURES, REPO_ROOT, Behavior, CrossrefStandIn, MirrorStandIn, UnpaywallStandIn,
+)
+from benchmarks.synthetic_pdfs import CORPUS, build_pdf  # noqa: E402
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(name: str, latencies: List[float], errors: int, wall: float) -> Dict:
+    ordered = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "scenario": name,
+        "count": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput_per_s": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": _ms(percentile(ordered, 50)),
+        "p95_ms": _ms(percentile(ordered, 95)),
+        "p99_ms": _ms(percentile(ordered, 99)),
+        "max_ms": _ms(ordered[-1] if ordered else None),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# --- App under test ---
+def start_app(env_overrides: Dict[str, str], port: int) -> subprocess.Popen:
+    env = {k: v for k, v in os.environ.items() if k not in ("SUPABASE_URL", "SUPABASE_KEY")}
+    env.update(env_overrides)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("App exited during startup")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/robots.txt", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("App did not start within 30s")
+
+
+# --- HTTP scenarios ---
+_session = threading.local()
+
+
+def _http() -> requests.Session:
+    if not hasattr(_session, "s"):
+        _session.s = requests.Session()
+    return _session.s
+
+
+def run_http(name: str, make_request, count: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            res = make_request(i)
+            ok = res.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(count)))
+    return summarize(name, latencies, errors, time.perf_counter() - wall_start)
+
+
+def process_request(base_url: str, timeout: float):
+    def make(i):
+        # Unique DOIs so nothing upstream or in-process can serve a cached answer
+        return _http().post(f"{base_url}/api/process", json={"doi": f"10.9999/loadtest.{uuid.uuid4().hex[:10]}"}, timeout=timeout)
+    return make
+
+
+def upload_request(base_url: str, pdf_bytes: bytes, timeout: float):
+    def make(i):
+        files = {"file": ("loadtest.pdf", pdf_bytes, "application/pdf")}
+        return _http().post(f"{base_url}/api/upload", files=files, timeout=timeout)
+    return make
+
+
+# --- WebSocket scenario ---
+async def _ws_client(url: str, client_id: int, messages: int, interval: float, latencies: List[float], errors: List[int]):
+    import websockets  # Already a dependency of the app (uvicorn[standard])
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.recv()  # init
+            pending: Dict[str, float] = {}
+            for i in range(messages):
+                tag = f"lt-{client_id}-{i}-{uuid.uuid4().hex[:6]}"
+                pending[tag] = time.perf_counter()
+                await ws.send(json.dumps({"type": "chat", "country": "LT", "msg": tag}))
+                # Keep reading until the full interval has passed, echo or not: sending again
+                # sooner would hit the server's 200ms debounce and be dropped
+                deadline = time.perf_counter() + interval
+                while (remaining := deadline - time.perf_counter()) > 0:
+                    try:
+                        raw = await asyncio.wait_for(ws.recv(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    try:
+                        event = json.loads(raw)
+                    except ValueError:
+                        continue
+                    msg = event.get("msg") if isinstance(event, dict) else None
+                    if msg in pending:
+                        latencies.append(time.perf_counter() - pending.pop(msg))
+            errors[0] += len(pending)  # Never echoed back
+    except Exception:
+        errors[0] += messages
+
+
+async def _run_ws(base_url: str, clients: int, messages: int, interval: float) -> Dict:
+    url = base_url.replace("http://", "ws://").replace("https://", "wss://") + "/ws?lb=delta"
+    latencies: List[float] = []
+    errors = [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(_ws_client(url, i, messages, interval, latencies, errors) for i in range(clients)))
+    return summarize("ws_chat_roundtrip", latencies, errors[0], time.perf_counter() - start)
+
+
+def run_ws(base_url: str, clients: int, messages: int, interval: float) -> Dict:
+    return asyncio.run(_run_ws(base_url, clients, messages, interval))
+
+
+def print_report(rows: List[Dict]):
+    header = f"{'scenario':<20} {'count':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['scenario']:<20} {r['count']:>6} {r['errors']:>6} {r['throughput_per_s'] or 0:>8.2f} "
+            f"{r['p50_ms'] or 0:>9.1f} {r['p95_ms'] or 0:>9.1f} {r['p99_ms'] or 0:>9.1f} {r['max_ms'] or 0:>9.1f}"
+        )
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="Base URL of an already running app (skips spawning one)")
+    parser.add_argument("--scenarios", nargs="*", default=["process", "upload", "ws"], choices=["process", "upload", "ws"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per HTTP scenario")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--pdf-case", default="jpeg_photos", choices=[c.name for c in CORPUS])
+    parser.add_argument("--mirrors", type=int, default=3)
+    parser.add_argument("--mirror-latency", type=float, default=0.05)
+    parser.add_argument("--mirror-jitter", type=float, default=0.05)
+    parser.add_argument("--mirror-error-rate", type=float, default=0.0)
+    parser.add_argument("--mirror-hang-rate", type=float, default=0.0)
+    parser.add_argument("--crossref-latency", type=float, default=0.05)
+    parser.add_argument("--crossref-error-rate", type=float, default=0.0)
+    parser.add_argument("--unpaywall-latency", type=float, default=0.05)
+    parser.add_argument("--no-unpaywall-pdf", action="store_true", help="Unpaywall knows no OA copy")
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--ws-messages", type=int, default=5)
+    parser.add_argument("--ws-interval", type=float, default=0.6, help="Seconds between a client's messages (server debounces <0.2s)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    case = next(c for c in CORPUS if c.name == args.pdf_case)
+    pdf_bytes = build_pdf(case)
+
+    standins = []
+    app_proc = None
+    base_url = args.target.rstrip("/") if args.target else None
+    try:
+        if base_url is None:
+            mirror_behavior = Behavior(args.mirror_latency, args.mirror_jitter, args.mirror_error_rate, args.mirror_hang_rate)
+            mirrors = [
+                MirrorStandIn(pdf_bytes, fixture=MIRROR_FIXTURES[i % len(MIRROR_FIXTURES)], behavior=mirror_behavior, seed=i).start()
+                for i in range(args.mirrors)
+            ]
+            crossref = CrossrefStandIn(behavior=Behavior(args.crossref_latency, error_rate=args.crossref_error_rate)).start()
+            unpaywall = UnpaywallStandIn(None if args.no_unpaywall_pdf else pdf_bytes, behavior=Behavior(args.unpaywall_latency)).start()
+            standins = [*mirrors, crossref, unpaywall]
+            port = _free_port()
+            app_proc = start_app({
+                "SCIHUB_MIRRORS": ",".join(m.url for m in mirrors),
+                "CROSSREF_API_URL": crossref.url,
+                "UNPAYWALL_API_URL": unpaywall.url,
+                "DATA_DIR": tempfile.mkdtemp(prefix="paperprism-loadtest-"),
+            }, port)
+            base_url = f"http://127.0.0.1:{port}"
+
+        rows = []
+        if "process" in args.scenarios:
+            rows.append(run_http("process", process_request(base_url, args.timeout), args.requests, args.concurrency))
+        if "upload" in args.scenarios:
+            rows.append(run_http("upload", upload_request(base_url, pdf_bytes, args.timeout), args.requests, args.concurrency))
+        if "ws" in args.scenarios:
+            rows.append(run_ws(base_url, args.ws_clients, args.ws_messages, args.ws_interval))
+
+        print_report(rows)
+        if standins:
+            print("\nStand-in hits: " + ", ".join(f"{s.name}@{s.url}={s.hits}" for s in standins))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(rows, f, indent=2)
+        return 0
+    finally:
+        if app_proc is not None:
+            app_proc.terminate()
+            try:
+                app_proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                app_proc.kill()
+        for s in standins:
+            s.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
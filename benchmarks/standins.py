@@ -0,0 +1,162 @@
+"""
+Local HTTP stand-ins for the upstreams utils.get_pdf_from_scihub_advanced talks to.
+
+  MirrorStandIn     serves the captured mirror pages (debug_sci-hub.*.html) for any DOI,
+                    and a synthetic PDF for the /storage/... link those pages embed
+  CrossrefStandIn   /works/{doi} metadata JSON
+  UnpaywallStandIn  /v2/{doi} JSON pointing at its own /oa/{doi}.pdf
+
+Every stand-in takes a Behavior: added latency (+ jitter), a fraction of 503 errors and
+a fraction of requests that hang (held open without a response, like a dead mirror).
+Plain http.server in daemon threads; nothing beyond the stdlib.
+"""
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIRROR_FIXTURES = [
+    os.path.join(REPO_ROOT, "debug_sci-hub.se.html"),
+    os.path.join(REPO_ROOT, "debug_sci-hub.ru.html"),
+]
+
+
+@dataclass
+class Behavior:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    hang_rate: float = 0.0
+    hang_seconds: float = 60.0  # Longer than any client timeout in utils.py
+
+
+class StandIn(ABC):
+    name = "standin"
+
+    def __init__(self, behavior: Optional[Behavior] = None, seed: int = 0):
+        self.behavior = behavior or Behavior()
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.hits = 0
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @abstractmethod
+    def respond(self, path: str):
+        """(status, content_type, body) for a path, or None for 404."""
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, port: int = 0) -> "StandIn":
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                standin.hits += 1
+                if standin._misbehave(self):
+                    return
+                result = standin.respond(self.path.split("?", 1)[0])
+                status, content_type, body = result or (404, "text/plain", b"not found")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name=self.name, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _roll(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+    def _misbehave(self, handler: BaseHTTPRequestHandler) -> bool:
+        b = self.behavior
+        delay = b.latency + (b.jitter * self._roll() if b.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        roll = self._roll()
+        if roll < b.hang_rate:
+            time.sleep(b.hang_seconds)
+            handler.close_connection = True
+            return True
+        if roll < b.hang_rate + b.error_rate:
+            handler.send_error(503, "Service Unavailable")
+            return True
+        return False
+
+
+class MirrorStandIn(StandIn):
+    name = "mirror"
+
+    def __init__(self, pdf_bytes: bytes, fixture: str = MIRROR_FIXTURES[0], **kwargs):
+        super().__init__(**kwargs)
+        self.pdf_bytes = pdf_bytes
+        with open(fixture, "rb") as f:
+            self.page = f.read()
+
+    def respond(self, path):
+        if path.startswith("/storage/") and path.endswith(".pdf"):
+            return 200, "application/pdf", self.pdf_bytes
+        if len(path) > 1:
+            return 200, "text/html; charset=utf-8", self.page
+        return None
+
+
+class CrossrefStandIn(StandIn):
+    name = "crossref"
+
+    def respond(self, path):
+        if not path.startswith("/works/"):
+            return None
+        doi = path[len("/works/"):]
+        body = {
+            "status": "ok",
+            "message": {
+                "DOI": doi,
+                "title": [f"Synthetic paper {doi}"],
+                "container-title": ["Journal of Load Testing"],
+                "short-container-title": ["J Load Test"],
+                "created": {"date-parts": [[2024, 1, 1]]},
+                "author": [{"given": "Ada", "family": "Lovelace"}, {"given": "Alan", "family": "Turing"}],
+            },
+        }
+        return 200, "application/json", json.dumps(body).encode()
+
+
+class UnpaywallStandIn(StandIn):
+    name = "unpaywall"
+
+    def __init__(self, pdf_bytes: Optional[bytes], **kwargs):
+        super().__init__(**kwargs)
+        self.pdf_bytes = pdf_bytes  # None: every DOI is closed access
+
+    def respond(self, path):
+        if path.startswith("/v2/"):
+            doi = path[len("/v2/"):]
+            location = {"url_for_pdf": f"{self.url}/oa/{doi.replace('/', '_')}.pdf"} if self.pdf_bytes else None
+            body = {"doi": doi, "title": f"Synthetic paper {doi}", "best_oa_location": location}
+            return 200, "application/json", json.dumps(body).encode()
+        if path.startswith("/oa/") and self.pdf_bytes:
+            return 200, "application/pdf", self.pdf_bytes
+        return None
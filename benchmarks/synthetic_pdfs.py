@@ -0,0 +1,146 @@
+"""
+Deterministic synthetic PDF corpus for the extraction benchmarks and the load-test harness.
+
+Each case exercises one shape of real papers: photo-heavy JPEG figures, PNG plots,
+bilevel scans, a logo shared by every page (one xref, many references), tiny icons
+that extraction should skip cheaply, and long documents.
+
+PyMuPDF cannot encode JBIG2, so "bilevel" pages embed 1-bit Flate images, the same
+kind of content JBIG2 carries in scanned papers. Real JBIG2 PDFs can be added to a
+run with `bench_extraction.py --extra DIR`.
+"""
+import random
+from dataclasses import dataclass
+from typing import Dict, List
+
+import fitz  # PyMuPDF
+
+PAGE_RECT = fitz.paper_rect("a4")
+
+
+@dataclass(frozen=True)
+class CorpusCase:
+    name: str
+    pages: int
+    images_per_page: int = 0
+    image_format: str = "jpeg"    # jpeg | png | bilevel
+    image_size: tuple = (800, 600)
+    shared_logo: bool = False     # One extra image xref referenced from every page
+    icons_per_page: int = 0       # 16x16 PNGs
+
+
+CORPUS: List[CorpusCase] = [
+    CorpusCase("text_only", pages=20),
+    CorpusCase("jpeg_photos", pages=10, images_per_page=2, image_format="jpeg", image_size=(1200, 900)),
+    CorpusCase("png_figures", pages=10, images_per_page=3, image_format="png", image_size=(800, 600)),
+    CorpusCase("bilevel_scans", pages=10, images_per_page=1, image_format="bilevel", image_size=(2480, 3508)),
+    CorpusCase("shared_logo", pages=50, images_per_page=1, image_format="jpeg", image_size=(400, 300), shared_logo=True),
+    CorpusCase("tiny_icons", pages=10, icons_per_page=30),
+    CorpusCase("many_pages", pages=300, images_per_page=1, image_format="jpeg", image_size=(400, 300)),
+]
+
+
+def _rgb_samples(width: int, height: int, rng: random.Random) -> bytes:
+    # Gradient rows with a per-row shift and a little noise: compresses like a figure, not like static
+    base = bytes((x * 3 + rng.randrange(8)) % 256 for x in range(width * 3))
+    rows = []
+    for y in range(height):
+        shift = (y * 7) % len(base)
+        rows.append(base[shift:] + base[:shift])
+    return b"".join(rows)
+
+
+def _bilevel_samples(width: int, height: int, rng: random.Random) -> bytes:
+    # Text-like runs of black on white, 1 bit per pixel
+    row_bytes = (width + 7) // 8
+    blank = b"\xff" * row_bytes
+    patterns = [bytes(rng.choice((0xFF, 0xFF, 0x00, 0x81)) for _ in range(row_bytes)) for _ in range(32)]
+    rows = []
+    for y in range(height):
+        if (y // 12) % 3 == 2:
+            rows.append(blank)  # Line spacing
+        else:
+            rows.append(patterns[rng.randrange(len(patterns))])
+    return b"".join(rows)
+
+
+def make_image(fmt: str, size: tuple, seed: int) -> bytes:
+    width, height = size
+    rng = random.Random(seed)
+    pix = fitz.Pixmap(fitz.csRGB, width, height, _rgb_samples(width, height, rng), False)
+    if fmt == "png":
+        return pix.tobytes("png")
+    return pix.tobytes("jpeg", jpg_quality=85)
+
+
+def _insert_bilevel(doc: fitz.Document, page: fitz.Page, rect: fitz.Rect, size: tuple, seed: int):
+    width, height = size
+    xref = doc.get_new_xref()
+    doc.update_object(
+        xref,
+        f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+        f"/ColorSpace /DeviceGray /BitsPerComponent 1 >>",
+    )
+    doc.update_stream(xref, _bilevel_samples(width, height, random.Random(seed)), compress=True)
+    page.insert_image(rect, xref=xref)
+
+
+def _slots(count: int) -> List[fitz.Rect]:
+    """Stack `count` image boxes down the page."""
+    if count <= 0:
+        return []
+    margin = 36
+    height = (PAGE_RECT.height - 2 * margin) / count
+    return [
+        fitz.Rect(margin, margin + i * height, PAGE_RECT.width - margin, margin + (i + 1) * height - 6)
+        for i in range(count)
+    ]
+
+
+def build_pdf(case: CorpusCase, seed: int = 0) -> bytes:
+    doc = fitz.open()
+    logo_xref = 0
+    logo = make_image("png", (320, 80), seed + 999_999) if case.shared_logo else None
+    icon = make_image("png", (16, 16), seed + 777_777) if case.icons_per_page else None
+
+    for page_no in range(case.pages):
+        page = doc.new_page(width=PAGE_RECT.width, height=PAGE_RECT.height)
+        page.insert_text((36, 24), f"{case.name} - page {page_no + 1}", fontsize=9)
+        for slot_no, rect in enumerate(_slots(case.images_per_page)):
+            image_seed = seed + page_no * 100 + slot_no
+            if case.image_format == "bilevel":
+                _insert_bilevel(doc, page, rect, case.image_size, image_seed)
+            else:
+                page.insert_image(rect, stream=make_image(case.image_format, case.image_size, image_seed))
+        if logo is not None:
+            logo_rect = fitz.Rect(PAGE_RECT.width - 140, 8, PAGE_RECT.width - 20, 38)
+            if logo_xref:
+                page.insert_image(logo_rect, xref=logo_xref)  # Same xref on every page
+            else:
+                logo_xref = page.insert_image(logo_rect, stream=logo)
+        for i in range(case.icons_per_page):
+            x, y = 36 + (i % 10) * 20, PAGE_RECT.height - 80 + (i // 10) * 20
+            page.insert_image(fitz.Rect(x, y, x + 16, y + 16), stream=icon)
+
+    data = doc.tobytes(garbage=0, deflate=True)
+    doc.close()
+    return data
+
+
+def build_corpus(cases: List[CorpusCase] = None, seed: int = 0) -> Dict[str, bytes]:
+    return {case.name: build_pdf(case, seed) for case in (cases or CORPUS)}
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Write the synthetic PDF corpus to a directory.")
+    parser.add_argument("out_dir", nargs="?", default="bench_corpus")
+    args = parser.parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, data in build_corpus().items():
+        path = os.path.join(args.out_dir, f"{name}.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        print(f"{path}: {len(data) / 1e6:.2f} MB")
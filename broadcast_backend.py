@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("security_audit")
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+PRESENCE_TTL_SECONDS = 30        # A worker that stops heartbeating drops out of online counts
+PRESENCE_HEARTBEAT_SECONDS = 10
+
+
+class BroadcastBackend(ABC):
+    """
+    Fan-out bus shared by every worker serving /ws.
+    Chat/score events are published here and delivered to *every* worker (including the
+    publisher) through the handler given to start(); each worker then pushes them to its own
+    sockets and applies them to its local history/leaderboard replica.
+    Presence (country -> online count per worker) is shared so online counts are global.
+    """
+    @abstractmethod
+    async def start(self, on_event: EventHandler):
+        ...
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, event: dict):
+        ...
+
+    @abstractmethod
+    async def set_presence(self, counts: Dict[str, int]):
+        """Store this worker's country -> connection counts and notify all workers."""
+
+    @abstractmethod
+    async def get_presence(self) -> Dict[str, int]:
+        """Country -> connection counts summed over all live workers."""
+
+
+class MemoryBroadcastBackend(BroadcastBackend):
+    """Single-process backend: events go straight back to the local handler."""
+    def __init__(self):
+        self._on_event: Optional[EventHandler] = None
+        self._presence: Dict[str, int] = {}
+
+    async def start(self, on_event: EventHandler):
+        self._on_event = on_event
+
+    async def publish(self, event: dict):
+        if self._on_event:
+            await self._on_event(event)
+
+    async def set_presence(self, counts: Dict[str, int]):
+        self._presence = dict(counts)
+        await self.publish({"type": "presence"})
+
+    async def get_presence(self) -> Dict[str, int]:
+        return dict(self._presence)
+
+
+class RedisBroadcastBackend(BroadcastBackend):
+    """
+    Redis pub/sub backend for `uvicorn --workers N` or several replicas.
+    Any redis.asyncio-compatible client works, so fakeredis or a local redis-server can
+    stand in for the broker when testing.
+    """
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = "paperprism"):
+        if client is None:
+            import redis.asyncio as redis  # Optional dependency, only needed for this backend
+            client = redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+        self.channel = f"{prefix}:events"
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._counts: Dict[str, int] = {}
+        self._pubsub = None
+        self._tasks = []
+
+    def _presence_key(self, worker_id: str) -> str:
+        return f"{self.prefix}:presence:{worker_id}"
+
+    async def start(self, on_event: EventHandler):
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._tasks = [
+            asyncio.create_task(self._read_loop(on_event)),
+            asyncio.create_task(self._heartbeat_loop()),
+        ]
+        logger.info(f"Broadcast: Redis backend started (worker {self.worker_id})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        try:
+            await self.redis.delete(self._presence_key(self.worker_id))
+            await self.redis.srem(f"{self.prefix}:workers", self.worker_id)
+            await self.publish({"type": "presence"})
+            if self._pubsub is not None:
+                await self._pubsub.unsubscribe(self.channel)
+        except Exception as e:
+            logger.warning(f"Broadcast: Redis shutdown error: {e}")
+
+    async def _read_loop(self, on_event: EventHandler):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                await on_event(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast: Redis read error: {e}")
+                await asyncio.sleep(1)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
+            try:
+                await self._write_presence()
+            except Exception as e:
+                logger.warning(f"Broadcast: Presence heartbeat failed: {e}")
+
+    async def _write_presence(self):
+        await self.redis.set(self._presence_key(self.worker_id), json.dumps(self._counts), ex=PRESENCE_TTL_SECONDS)
+        await self.redis.sadd(f"{self.prefix}:workers", self.worker_id)
+
+    async def publish(self, event: dict):
+        await self.redis.publish(self.channel, json.dumps(event, separators=(",", ":"), ensure_ascii=False))
+
+    async def set_presence(self, counts: Dict[str, int]):
+        self._counts = dict(counts)
+        await self._write_presence()
+        await self.publish({"type": "presence"})
+
+    async def get_presence(self) -> Dict[str, int]:
+        workers_key = f"{self.prefix}:workers"
+        workers = sorted(await self.redis.smembers(workers_key))
+        if not workers:
+            return {}
+        values = await self.redis.mget([self._presence_key(w) for w in workers])
+        totals: Dict[str, int] = {}
+        for worker_id, raw in zip(workers, values):
+            if raw is None:  # Heartbeat expired: worker is gone
+                await self.redis.srem(workers_key, worker_id)
+                continue
+            for country, count in json.loads(raw).items():
+                totals[country] = totals.get(country, 0) + count
+        return totals
+
+
+def create_broadcast_backend(url: Optional[str]) -> BroadcastBackend:
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroadcastBackend(url)
+    return MemoryBroadcastBackend()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict
+
+import metrics
+
+logger = logging.getLogger("security_audit")
+
+# The supabase client is synchronous. Every call goes through run_db() so it runs on a
+# bounded pool of its own (never the event loop, never competing with PDF extraction in
+# the default threadpool), with a timeout, and is timed in one place.
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+DB_SLOW_QUERY_SECONDS = float(os.getenv("DB_SLOW_QUERY_SECONDS", "1.0"))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+
+class QueryStats:
+    """Per-label call count, error count, total and max latency."""
+    def __init__(self):
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, label: str, seconds: float, ok: bool):
+        with self._lock:
+            stat = self._stats.setdefault(label, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stat["count"] += 1
+            stat["total_seconds"] += seconds
+            stat["max_seconds"] = max(stat["max_seconds"], seconds)
+            if not ok:
+                stat["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {label: dict(stat) for label, stat in self._stats.items()}
+
+
+query_stats = QueryStats()
+
+
+async def run_db(label: str, fn, *args, timeout: float = DB_TIMEOUT_SECONDS, **kwargs):
+    """
+    Run a blocking DB/storage call on the DB pool.
+    `label` names the table and operation (e.g. "images.select") for latency stats.
+    Raises asyncio.TimeoutError after `timeout` seconds (the worker thread finishes in the background).
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    ok = False
+    try:
+        result = await asyncio.wait_for(loop.run_in_executor(db_executor, partial(fn, *args, **kwargs)), timeout)
+        ok = True
+        return result
+    finally:
+        elapsed = time.perf_counter() - start
+        query_stats.record(label, elapsed, ok)
+        table, _, op = label.partition(".")
+        metrics.DB_QUERY_SECONDS.observe(elapsed, table=table, op=op or "call", outcome="ok" if ok else "error")
+        if elapsed >= DB_SLOW_QUERY_SECONDS:
+            logger.warning(f"Slow DB call: {label} took {elapsed:.2f}s")
+
+
+async def execute(query, label: str, timeout: float = DB_TIMEOUT_SECONDS):
+    """await execute(supabase.table("x").select(...), "x.select")"""
+    return await run_db(label, query.execute, timeout=timeout)
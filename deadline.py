@@ -0,0 +1,84 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import metrics
+
+# Request-wide time budget for /api/process. Each stage asks for min(its own cap, what is left);
+# stages that stop early are listed in the response under "deadline.cut_short".
+PROCESS_DEADLINE_SECONDS = float(os.getenv("PROCESS_DEADLINE_SECONDS", "45"))
+MIN_STAGE_SECONDS = 0.5  # Below this a network call is not worth starting
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.expires = self.started + seconds
+        self.cut_short: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def exhausted(self) -> bool:
+        return self.remaining() < MIN_STAGE_SECONDS
+
+    def mark_cut(self, stage: str):
+        if stage not in self.cut_short:
+            self.cut_short.append(stage)
+            metrics.DEADLINE_CUTS.inc(stage=stage)
+
+    def report(self) -> dict:
+        return {
+            "budget_s": self.seconds,
+            "elapsed_s": round(time.monotonic() - self.started, 3),
+            "cut_short": list(self.cut_short),
+        }
+
+
+# Same sharing model as tracing._spans: run_in_threadpool copies the context, so the
+# Deadline object set in the route is the one utils/resolvers/downloader see.
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def budget(seconds: float = PROCESS_DEADLINE_SECONDS):
+    deadline = Deadline(seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def exhausted(stage: Optional[str] = None) -> bool:
+    """True when the current request's budget is spent (marking stage as cut); False outside a budget."""
+    deadline = _current.get()
+    if deadline is None or not deadline.exhausted():
+        return False
+    if stage:
+        deadline.mark_cut(stage)
+    return True
+
+
+def timeout(cap: float, stage: str) -> float:
+    """Timeout for the next call of a stage: cap, clipped to the remaining budget."""
+    deadline = _current.get()
+    if deadline is None:
+        return cap
+    if deadline.exhausted():
+        deadline.mark_cut(stage)
+        raise DeadlineExceeded(stage)
+    return min(cap, deadline.remaining())
+
+
+def check(stage: str):
+    """Raise DeadlineExceeded from inside a long loop once the budget is spent."""
+    if exhausted(stage):
+        raise DeadlineExceeded(stage)
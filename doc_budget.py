@@ -0,0 +1,98 @@
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger("security_audit")
+
+# Per-document limits. MAX_PDF_SIZE only bounds compressed input; these bound the work a
+# single file can cause (page walk, decoded pixels, image count, time) in extraction/sanitize.
+DOC_MAX_SECONDS = float(os.getenv("DOC_MAX_SECONDS", "30"))
+DOC_MAX_PAGES = int(os.getenv("DOC_MAX_PAGES", "2000"))
+DOC_MAX_IMAGES = int(os.getenv("DOC_MAX_IMAGES", "500"))
+DOC_MAX_DECODED_BYTES = int(os.getenv("DOC_MAX_DECODED_BYTES", str(1024 * 1024 * 1024)))
+
+_COMPONENTS = {"devicegray": 1, "calgray": 1, "devicecmyk": 4, "separation": 1, "indexed": 1}
+
+
+def decoded_size(width: int, height: int, bpc: int, colorspace: str) -> int:
+    """Estimated pixel bytes of an image once decoded, from its get_page_images() entry."""
+    components = _COMPONENTS.get((colorspace or "").lower(), 3)
+    return (max(width, 0) * max(height, 0) * components * max(bpc or 8, 1) + 7) // 8
+
+
+class DocumentBudget:
+    """Tracks one document's consumption; allow_*() return False once a limit is hit."""
+    def __init__(self, max_seconds: float = DOC_MAX_SECONDS, max_pages: int = DOC_MAX_PAGES,
+                 max_images: int = DOC_MAX_IMAGES, max_decoded_bytes: int = DOC_MAX_DECODED_BYTES):
+        self.max_seconds = max_seconds
+        self.max_pages = max_pages
+        self.max_images = max_images
+        self.max_decoded_bytes = max_decoded_bytes
+        self.started = time.monotonic()
+        self.page_count = 0
+        self.pages = 0
+        self.images = 0
+        self.decoded_bytes = 0
+        self.exceeded: List[str] = []
+        self.stopped = False
+
+    def _exceed(self, limit: str, stop: bool = True):
+        self.stopped = self.stopped or stop
+        if limit not in self.exceeded:
+            self.exceeded.append(limit)
+            metrics.DOC_BUDGET_EXCEEDED.inc(limit=limit)
+            logger.warning(f"Document budget exceeded: {limit} ({self.pages}/{self.page_count} pages, {self.images} images)")
+
+    def pages_allowed(self, page_count: int) -> int:
+        """How many of the document's pages may be walked."""
+        self.page_count = page_count
+        if page_count > self.max_pages:
+            self._exceed("pages", stop=False)
+        return min(page_count, self.max_pages)
+
+    def allow_page(self) -> bool:
+        if self.stopped:
+            return False
+        if time.monotonic() - self.started > self.max_seconds:
+            self._exceed("seconds")
+            return False
+        self.pages += 1
+        return True
+
+    def allow_image(self, decoded_bytes: int) -> bool:
+        """Reserve an image before it is decoded; False stops the walk."""
+        if self.images >= self.max_images:
+            self._exceed("images")
+            return False
+        if self.decoded_bytes + decoded_bytes > self.max_decoded_bytes:
+            self._exceed("decoded_bytes")
+            return False
+        if time.monotonic() - self.started > self.max_seconds:
+            self._exceed("seconds")
+            return False
+        self.images += 1
+        self.decoded_bytes += decoded_bytes
+        return True
+
+    def report(self) -> Dict:
+        return {
+            "pages": self.pages,
+            "page_count": self.page_count,
+            "images": self.images,
+            "decoded_bytes": self.decoded_bytes,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "exceeded": list(self.exceeded),
+        }
+
+
+def sanitize_refusal(page_count: int, object_count: int) -> Optional[str]:
+    """Reason to refuse a whole-file rewrite in sanitizer (repair or full tier), or None."""
+    if page_count > DOC_MAX_PAGES:
+        return f"{page_count} pages > {DOC_MAX_PAGES}"
+    # garbage=4 dedupes every object against every other; cost grows with the xref table
+    if object_count > DOC_MAX_PAGES * 200:
+        return f"{object_count} objects"
+    return None
@@ -0,0 +1,208 @@
+import contextvars
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import requests
+
+import deadline
+
+logger = logging.getLogger("security_audit")
+
+MAX_PDF_SIZE = 300 * 1024 * 1024  # 300MB Limit to Prevent DoS
+
+# Large files from servers that advertise Accept-Ranges are fetched as parallel byte ranges
+# written into a preallocated temp file; each range resumes from where it broke off.
+RANGED_MIN_BYTES = int(os.getenv("RANGED_MIN_BYTES", str(8 * 1024 * 1024)))
+RANGED_CHUNK_BYTES = int(os.getenv("RANGED_CHUNK_BYTES", str(4 * 1024 * 1024)))
+RANGED_CONNECTIONS = int(os.getenv("RANGED_CONNECTIONS", "4"))
+RANGED_RETRIES = 3
+READ_CHUNK = 64 * 1024
+PAGE_MAX_BYTES = 10 * 1024 * 1024  # Mirror pages and API JSON; anything bigger is not one
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class RangeAborted(Exception):
+    """Another range failed; this one stops instead of finishing a doomed download."""
+
+
+@dataclass
+class DownloadResult:
+    status: int
+    content: bytes
+    seconds: float
+    connections: int = 1
+
+    @property
+    def rate(self) -> float:
+        """Bytes per second."""
+        return len(self.content) / self.seconds if self.seconds else 0.0
+
+
+def _read_all(res: requests.Response, limit: int = MAX_PDF_SIZE) -> bytes:
+    buf = bytearray()
+    for chunk in res.iter_content(chunk_size=READ_CHUNK):
+        buf += chunk
+        if len(buf) > limit:
+            raise ValueError("File too large")
+        deadline.check("download")
+    return bytes(buf)
+
+
+def _read_upto(res: requests.Response, limit: int) -> bytes:
+    buf = bytearray()
+    for chunk in res.iter_content(chunk_size=READ_CHUNK):
+        buf += chunk
+        if len(buf) >= limit:
+            break
+        deadline.check("download")
+    return bytes(buf[:limit])
+
+
+def _shut(sock, cut: threading.Event):
+    cut.set()
+    try:
+        # socket.socket's own shutdown, not SSLSocket's, which would unwrap under the reader
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except (OSError, TypeError):
+        pass
+
+
+def get_body(url: str, cap: float, stage: str, limit: int = PAGE_MAX_BYTES, **kwargs) -> Tuple[int, bytes]:
+    """
+    GET a small body (mirror page, API JSON) in at most cap seconds overall, clipped to the
+    request deadline. A requests timeout only bounds each socket read, so a server that
+    trickles bytes could hold the call forever; a timer shuts the socket when time is up.
+    """
+    seconds = deadline.timeout(cap, stage)
+    start = time.monotonic()
+    with requests.get(url, timeout=seconds, stream=True, **kwargs) as res:
+        if res.status_code != 200:
+            return res.status_code, b""
+        cut = threading.Event()
+        sock = getattr(res.raw.connection, "sock", None)
+        timer = threading.Timer(max(0.0, seconds - (time.monotonic() - start)), _shut, (sock, cut))
+        timer.daemon = True
+        timer.start()
+        buf = bytearray()
+        try:
+            for chunk in res.iter_content(chunk_size=READ_CHUNK):
+                buf += chunk
+                if len(buf) > limit:
+                    raise ValueError("Response too large")
+                deadline.check(stage)
+        except requests.RequestException:
+            if not cut.is_set():
+                raise
+        finally:
+            timer.cancel()
+        if cut.is_set():
+            deadline.check(stage)  # DeadlineExceeded if it was the request budget that ran out
+            raise requests.Timeout(f"{stage}: no complete response within {seconds:.1f}s")
+        return 200, bytes(buf)
+
+
+def _fetch_range(url: str, headers: Dict, timeout: float, fd: int, start: int, end: int, stop: threading.Event):
+    """Write bytes start..end (inclusive) at their offsets in fd, resuming after short reads."""
+    pos = start
+    attempts = 0
+    while pos <= end:
+        if stop.is_set():
+            raise RangeAborted()
+        try:
+            range_headers = {**headers, "Range": f"bytes={pos}-{end}"}
+            range_timeout = deadline.timeout(timeout, "download")
+            with requests.get(url, headers=range_headers, timeout=range_timeout, verify=False, stream=True) as r:
+                if r.status_code != 206 or not r.headers.get("Content-Range", "").startswith(f"bytes {pos}-"):
+                    raise RangeNotSupported(f"status {r.status_code}")
+                for chunk in r.iter_content(chunk_size=READ_CHUNK):
+                    take = chunk[: end - pos + 1]
+                    os.pwrite(fd, take, pos)
+                    pos += len(take)
+                    if pos > end:
+                        break
+                    if stop.is_set():
+                        raise RangeAborted()
+                    deadline.check("download")
+            if pos <= end:
+                raise IOError(f"short read at {pos}")
+        except RangeNotSupported:
+            raise
+        except (requests.RequestException, IOError) as e:
+            attempts += 1
+            if attempts > RANGED_RETRIES:
+                raise
+            logger.info(f"Resuming range {pos}-{end} (attempt {attempts}): {e}")
+
+
+def _ranged(url: str, headers: Dict, timeout: float, size: int, head: bytes) -> bytes:
+    with tempfile.TemporaryFile() as f:
+        f.truncate(size)  # Preallocate; ranges land at their own offsets
+        fd = f.fileno()
+        os.pwrite(fd, head, 0)
+        ranges = [(s, min(s + RANGED_CHUNK_BYTES, size) - 1) for s in range(len(head), size, RANGED_CHUNK_BYTES)]
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=RANGED_CONNECTIONS, thread_name_prefix="range")
+        try:
+            # Each range runs in a copy of the caller's context so it shares the request deadline
+            futures = [pool.submit(contextvars.copy_context().run, _fetch_range, url, headers, timeout, fd, s, e, stop) for s, e in ranges]
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            stop.set()  # First failure: queued ranges are cancelled, running ones bail at their next chunk
+            raise
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)  # No pwrite may outlive the temp file
+        f.seek(0)
+        return f.read()
+
+
+def download(url: str, headers: Dict, timeout: float) -> DownloadResult:
+    """
+    GET a file. Large files (>= RANGED_MIN_BYTES) from servers with Accept-Ranges: bytes
+    are split into RANGED_CHUNK_BYTES ranges over RANGED_CONNECTIONS connections; the
+    first range is read from the initial response itself. Falls back to one plain GET if
+    the server stops honouring ranges.
+    """
+    start = time.perf_counter()
+    res = requests.get(url, headers=headers, timeout=timeout, verify=False, stream=True)
+    try:
+        if res.status_code != 200:
+            return DownloadResult(res.status_code, b"", time.perf_counter() - start)
+        size = int(res.headers.get("Content-Length") or 0)
+        if size > MAX_PDF_SIZE:
+            raise ValueError("File too large")
+        rangeable = (
+            size >= RANGED_MIN_BYTES
+            and res.headers.get("Accept-Ranges", "").lower() == "bytes"
+            and not res.headers.get("Content-Encoding")  # Length/ranges would refer to the encoded body
+        )
+        if not rangeable:
+            return DownloadResult(200, _read_all(res), time.perf_counter() - start)
+        head = _read_upto(res, RANGED_CHUNK_BYTES)
+        final_url = res.url  # After redirects
+    finally:
+        res.close()
+
+    if b'%PDF' not in head[:100] or len(head) >= size:
+        return DownloadResult(200, head, time.perf_counter() - start)
+    try:
+        content = _ranged(final_url, headers, timeout, size, head)
+        connections = min(RANGED_CONNECTIONS, -(-(size - len(head)) // RANGED_CHUNK_BYTES)) + 1
+        return DownloadResult(200, content, time.perf_counter() - start, connections)
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Ranged download failed, retrying as a single stream: {e}")
+        with requests.get(final_url, headers=headers, timeout=deadline.timeout(timeout, "download"), verify=False, stream=True) as res:
+            content = _read_all(res) if res.status_code == 200 else b""
+            return DownloadResult(res.status_code, content, time.perf_counter() - start)
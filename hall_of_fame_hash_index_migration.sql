@@ -0,0 +1,6 @@
+-- Index for the like-path lookup by image hash.
+-- /api/like checks the database before treating an image as new, because with
+-- several workers another one may have inserted it since this worker's
+-- Hall of Fame index was loaded.
+
+create index if not exists images_hash_idx on public.images (image_hash);
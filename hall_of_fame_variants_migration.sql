@@ -0,0 +1,12 @@
+-- Store paths of the WebP variants generated for Hall of Fame images.
+-- thumb_path: small grid thumbnail, preview_path: larger lightbox variant.
+-- Both live in the 'paper_images' bucket under variants/.
+--
+-- Rows created before this migration keep NULL here and are served from
+-- storage_path (the original upload) by /api/trending.
+
+alter table public.images
+add column if not exists thumb_path text;
+
+alter table public.images
+add column if not exists preview_path text;
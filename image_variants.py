@@ -0,0 +1,46 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from PIL import Image
+
+logger = logging.getLogger("security_audit")
+
+# name -> longest edge in px. Hall of Fame grid uses "thumb", the lightbox uses "preview".
+VARIANT_SIZES = {
+    "thumb": 400,
+    "preview": 1280,
+}
+WEBP_QUALITY = 80
+MAX_SOURCE_PIXELS = 50_000_000  # Decompression bomb guard (~7000x7000)
+
+# Pillow releases the GIL while resampling/encoding, so threads scale across cores here.
+variant_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webp")
+
+def variant_path(img_hash: str, name: str) -> str:
+    return f"variants/{img_hash}_{name}.webp"
+
+def make_webp_variants(image_bytes: bytes) -> Dict[str, bytes]:
+    """
+    Build size-bounded WebP variants of an image.
+    Returns {variant_name: webp_bytes}. "thumb" is always built (a WebP re-encode
+    still beats a large PNG in the grid); the other variants are skipped when the
+    source already fits their bound (the original is served instead).
+    """
+    variants = {}
+    with Image.open(io.BytesIO(image_bytes)) as src:
+        if src.width * src.height > MAX_SOURCE_PIXELS:
+            raise ValueError("Image too large for thumbnailing")
+        src.seek(0)  # First frame only for GIFs
+        img = src.convert("RGBA" if src.mode in ("RGBA", "LA", "P") else "RGB")
+
+    for name, bound in VARIANT_SIZES.items():
+        if img.width <= bound and img.height <= bound and name != "thumb":
+            continue
+        variant = img.copy()
+        variant.thumbnail((bound, bound), Image.LANCZOS)
+        buf = io.BytesIO()
+        variant.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+        variants[name] = buf.getvalue()
+    return variants
@@ -0,0 +1,69 @@
+import base64
+import json
+from typing import Iterator
+
+import memory_ledger
+
+# Incremental JSON encoding for the extraction responses. Large binary fields are kept as
+# Base64Blob (raw bytes) in the result dict and only base64-encoded a slice at a time while
+# the body is written, so a response never exists as one base64 string plus one JSON string.
+ENCODE_SLICE = 3 * 64 * 1024  # Multiple of 3: slices encode to base64 that concatenates cleanly
+FLUSH_BYTES = 256 * 1024
+
+
+class Base64Blob:
+    """A JSON string value rendered as prefix + base64(data)."""
+    __slots__ = ("data", "prefix")
+
+    def __init__(self, data: bytes, prefix: str = ""):
+        self.data = data
+        self.prefix = prefix
+
+    def encoded_size(self) -> int:
+        return len(self.prefix) + 4 * ((len(self.data) + 2) // 3)
+
+
+def _parts(value) -> Iterator[bytes]:
+    if isinstance(value, Base64Blob):
+        yield b'"' + json.dumps(value.prefix, ensure_ascii=False)[1:-1].encode("utf-8")
+        view = memoryview(value.data)
+        for offset in range(0, len(view), ENCODE_SLICE):
+            yield base64.b64encode(view[offset:offset + ENCODE_SLICE])
+        yield b'"'
+    elif isinstance(value, dict):
+        yield b"{"
+        for i, (key, item) in enumerate(value.items()):
+            yield (b"," if i else b"") + json.dumps(str(key), ensure_ascii=False).encode("utf-8") + b":"
+            yield from _parts(item)
+        yield b"}"
+    elif isinstance(value, (list, tuple)):
+        yield b"["
+        for i, item in enumerate(value):
+            if i:
+                yield b","
+            yield from _parts(item)
+        yield b"]"
+    else:
+        yield json.dumps(value, ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+
+def _held(chunk: bytes) -> Iterator[bytes]:
+    # Charged to the request while the server writes it; released even if the client goes away
+    memory_ledger.hold(len(chunk))
+    try:
+        yield chunk
+    finally:
+        memory_ledger.release(len(chunk))
+
+
+def iter_json(value) -> Iterator[bytes]:
+    """Yield the JSON encoding of value in chunks of about FLUSH_BYTES."""
+    buf = bytearray()
+    for part in _parts(value):
+        buf += part
+        if len(buf) >= FLUSH_BYTES:
+            chunk = bytes(buf)
+            buf.clear()
+            yield from _held(chunk)
+    if buf:
+        yield from _held(bytes(buf))
@@ -0,0 +1,16 @@
+-- Atomic leaderboard increments for the write-behind queue (PersistenceQueue.flush).
+-- increments: {"KR": [score_inc, chat_inc], ...}
+-- A plain read-then-upsert loses updates when several workers flush at once;
+-- this adds to the stored totals inside one statement instead.
+
+create or replace function public.apply_leaderboard_increments(increments jsonb)
+returns void
+language sql
+as $$
+  insert into public.leaderboard (country, score, chat_count)
+  select key, coalesce((value->>0)::bigint, 0), coalesce((value->>1)::bigint, 0)
+  from jsonb_each(increments)
+  on conflict (country) do update
+    set score = coalesce(public.leaderboard.score, 0) + excluded.score,
+        chat_count = coalesce(public.leaderboard.chat_count, 0) + excluded.chat_count;
+$$;
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("security_audit")
+
+# How often the loop is probed, and how late a probe may wake before it counts as a stall
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.1"))
+LOOP_LAG_THRESHOLD_SECONDS = float(os.getenv("LOOP_LAG_THRESHOLD_SECONDS", "0.2"))
+LOOP_LAG_RECENT = 20
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_app_file(filename: str) -> bool:
+    return filename.startswith(_APP_DIR) and filename != __file__ and "site-packages" not in filename
+
+
+async def _run_labelled(label: str, awaitable):
+    # The watchdog finds this frame on the loop thread's stack and reads `label` from it
+    return await awaitable
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop scheduling delay and names what blocked it.
+
+    A probe task sleeps for `interval` and records how late it wakes. Meanwhile a watchdog
+    thread checks the probe's heartbeat; once it is older than `threshold` the loop is stuck
+    in synchronous code, so the watchdog samples the loop thread's stack. The sample gives
+    the innermost app frame (the culprit) and the route/job label of the enclosing
+    _run_labelled frame (see track() and LoopActivityMiddleware).
+    """
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS, threshold: float = LOOP_LAG_THRESHOLD_SECONDS):
+        self.interval = interval
+        self.threshold = threshold
+        self.probes = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.total_stall_seconds = 0.0
+        self.by_culprit: Dict[str, Dict] = {}
+        self.recent = deque(maxlen=LOOP_LAG_RECENT)
+        self._beat = time.monotonic()
+        self._sample: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._probe_loop())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    def track(self, label: str, fn):
+        """Wrap a coroutine function (e.g. a scheduler job) so stalls inside it carry `label`."""
+        async def wrapper(*args, **kwargs):
+            return await _run_labelled(label, fn(*args, **kwargs))
+        wrapper.__name__ = getattr(fn, "__name__", label)
+        return wrapper
+
+    async def _probe_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            with self._lock:
+                sample, self._sample = self._sample, None
+            self._record(lag, sample)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            if time.monotonic() - self._beat < self.threshold + self.interval:
+                continue
+            with self._lock:
+                if self._sample is None:
+                    self._sample = self._sample_stack()
+
+    def _sample_stack(self) -> Dict:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack: List[str] = []
+        activity = None
+        while frame is not None:
+            code = frame.f_code
+            if code is _run_labelled.__code__:
+                if activity is None:
+                    activity = frame.f_locals.get("label")
+            elif _is_app_file(code.co_filename):
+                stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+            frame = frame.f_back
+        return {
+            "activity": activity or "unlabelled",
+            "culprit": stack[0] if stack else "unknown",  # Innermost app frame
+            "stack": stack[:8],
+        }
+
+    def _record(self, lag: float, sample: Optional[Dict]):
+        self.probes += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag < self.threshold:
+            return
+        sample = sample or {"activity": "unlabelled", "culprit": "unknown", "stack": []}
+        self.stalls += 1
+        self.total_stall_seconds += lag
+        key = f"{sample['activity']} @ {sample['culprit']}"
+        stat = self.by_culprit.setdefault(key, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stat["count"] += 1
+        stat["total_seconds"] += lag
+        stat["max_seconds"] = max(stat["max_seconds"], lag)
+        self.recent.append({"at": time.time(), "lag_seconds": round(lag, 4), **sample})
+        logger.warning(f"Event loop blocked for {lag:.2f}s in {sample['activity']} ({sample['culprit']})")
+
+    def snapshot(self) -> Dict:
+        return {
+            "threshold_seconds": self.threshold,
+            "probes": self.probes,
+            "stalls": self.stalls,
+            "last_lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4),
+            "total_stall_seconds": round(self.total_stall_seconds, 4),
+            "by_culprit": {k: dict(v) for k, v in self.by_culprit.items()},
+            "recent": list(self.recent),
+        }
+
+
+class LoopActivityMiddleware:
+    """ASGI middleware labelling each HTTP request / WebSocket as "METHOD /path" for the monitor."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            label = f"{scope['method']} {scope['path']}"
+        elif scope["type"] == "websocket":
+            label = f"WS {scope['path']}"
+        else:
+            return await self.app(scope, receive, send)
+        return await _run_labelled(label, self.app(scope, receive, send))
+
+
+loop_monitor = LoopLagMonitor()
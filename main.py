@@ -1,21 +1,22 @@
 
 import os
 import shutil
-import base64
 import asyncio
 import logging
 import json
 import hashlib
 import time
 import re
+import threading
+import uuid
 from typing import List, Dict, Optional
-from collections import Counter, deque
+from collections import deque, OrderedDict
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form, Request, status, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form, Request, status, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse, Response, FileResponse
+from fastapi.responses import JSONResponse, Response, FileResponse, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
 from fastapi.exception_handlers import http_exception_handler
 from fastapi.staticfiles import StaticFiles
@@ -27,7 +28,22 @@ import fitz  # PyMuPDF
 from supabase import create_client, Client
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from utils import sanitize_and_compress_pdf, get_pdf_from_scihub_advanced
+from utils import get_pdf_from_scihub_advanced
+from image_variants import make_webp_variants, variant_path, variant_pool
+from broadcast_backend import create_broadcast_backend
+from repository import create_repository, SQLiteRepository
+from db import query_stats
+from doc_budget import DocumentBudget, decoded_size
+from loop_monitor import loop_monitor, LoopActivityMiddleware
+import deadline
+import memory_ledger
+import metrics
+import tracing
+from json_stream import Base64Blob, iter_json
+from sanitizer import sanitize_pdf, SANITIZE_TIERS
+from profiler import profile_call, profile_store, is_admin
+from resolvers import router as resolver_router
+from ws_protocol import encode_message, negotiate_encoding, ENCODING_JSON, COMPACT_SUBPROTOCOL
 
 # --- 1. CONFIGURATION & SECRETS (Secret Management) ---
 # --- 1. CONFIGURATION & SECRETS (Secret Management) ---
@@ -39,6 +55,10 @@ class Settings:
         self.allowed_hosts = ["*"]  # Allow all for HF Spaces / Cloud
         self.allowed_origins = ["*"] # Adjust in production!
         self.current_env = os.getenv("CURRENT_ENV", "production")
+        # Chat fan-out bus: unset = in-process, redis://... = shared across workers/replicas
+        self.broadcast_url = os.getenv("BROADCAST_URL")
+        # Local SQLite + blob store used when Supabase is not configured
+        self.data_dir = os.getenv("DATA_DIR", "data")
 
 settings = Settings()
 
@@ -65,7 +85,10 @@ if settings.supabase_url and settings.supabase_key:
         logger.error(f"Supabase init failed: {e}")
         print(f"Supabase Init Error: {e}")
 else:
-    logger.warning("Supabase credentials (SUPABASE_URL, SUPABASE_KEY) are MISSING. Persistence will be disabled.")
+    logger.warning("Supabase credentials (SUPABASE_URL, SUPABASE_KEY) are MISSING. Falling back to local storage.")
+
+# Persistence backend: Supabase when configured, otherwise SQLite + files under DATA_DIR
+repo = create_repository(supabase, settings.supabase_url, settings.data_dir)
 
 
 # --- 2. VOTE MANAGER (IP-Based Deduplication / Anti-Abuse) ---
@@ -79,7 +102,7 @@ class VoteManager:
     def hash_ip(self, ip: str) -> str:
         return hashlib.sha256(ip.encode()).hexdigest()[:16]
 
-    def has_voted(self, image_id: str, ip: str) -> bool:
+    async def has_voted(self, image_id: str, ip: str) -> bool:
         ip_hash = self.hash_ip(ip)
         cache_key = f"{image_id}:{ip_hash}"
         
@@ -87,11 +110,10 @@ class VoteManager:
         if cache_key in self.local_cache:
             return True
             
-        # 2. Check Supabase (Persistent)
-        if supabase:
+        # 2. Check Repository (Persistent)
+        if repo:
             try:
-                res = supabase.table("votes").select("id").eq("image_id", image_id).eq("ip_hash", ip_hash).execute()
-                if res.data:
+                if await repo.has_vote(image_id, ip_hash):
                     self.local_cache.add(cache_key) # Populate cache
                     return True
             except Exception as e:
@@ -101,21 +123,21 @@ class VoteManager:
                 
         return False
 
-    def register_vote(self, image_id: str, ip: str):
+    async def register_vote(self, image_id: str, ip: str):
         ip_hash = self.hash_ip(ip)
         cache_key = f"{image_id}:{ip_hash}"
         
         # 1. Update Local
         self.local_cache.add(cache_key)
         
-        # 2. Update Supabase
-        if supabase:
+        # 2. Update Repository
+        if repo:
             try:
                 # Assuming 'votes' table exists: id (int, auto), image_id (int), ip_hash (str, index)
-                supabase.table("votes").insert({"image_id": image_id, "ip_hash": ip_hash}).execute()
+                await repo.add_vote(image_id, ip_hash)
                 return True
             except Exception as e:
-                logger.error(f"Failed to persist vote to Supabase: {e}")
+                logger.error(f"Failed to persist vote: {e}")
                 # Note: If duplicate, it might error, which is fine.
         return True
 
@@ -168,56 +190,207 @@ def normalize_hall_of_fame_source_type(value: Optional[str], doi: Optional[str]
             return normalized
     return "doi" if normalize_hall_of_fame_doi(doi) else "pdf_upload"
 
-def should_retry_without_source_type(error: Exception) -> bool:
-    message = str(error).lower()
-    return "source_type" in message and (
-        "column" in message
-        or "schema cache" in message
-        or "could not find" in message
-        or "does not exist" in message
-    )
-
-def insert_image_row(payload: Dict):
+# --- 3b. HALL OF FAME INDEX (In-Process Mirror of 'images') ---
+HALL_OF_FAME_LIMIT = 50
+
+class HallOfFameIndex:
+    """
+    image_hash -> row mirror of the (small, capped) images table.
+    Rows are kept in created_at order so the eviction candidate is always the first entry.
+    Writes go through this index; a periodic refresh picks up external edits.
+    """
+    def __init__(self, limit: int = HALL_OF_FAME_LIMIT):
+        self.limit = limit
+        self.loaded = False
+        self._rows: "OrderedDict[str, Dict]" = OrderedDict()  # image_hash -> row (oldest first)
+        self._hash_by_id: Dict[str, str] = {}
+        self._writes = 0  # Bumped on every local write; a refresh that overlaps one is discarded
+        self._hash_locks: Dict[str, list] = {}  # image_hash -> [asyncio.Lock, holders + waiters]
+
+    async def refresh(self):
+        if not repo: return
+        writes_before = self._writes
+        data = await repo.list_images()
+        rows = OrderedDict()
+        hash_by_id = {}
+        for row in data:
+            img_hash = row.get("image_hash")
+            if not img_hash: continue
+            rows[img_hash] = row
+            hash_by_id[str(row["id"])] = img_hash
+        if self.loaded and self._writes != writes_before:
+            logger.info("HallOfFameIndex: Refresh raced with a write, keeping local state")
+            return
+        # Swap in one step so readers never see a half-built index
+        self._rows, self._hash_by_id = rows, hash_by_id
+        self.loaded = True
+        logger.info(f"HallOfFameIndex: Loaded {len(rows)} rows")
+
+    @asynccontextmanager
+    async def hash_lock(self, img_hash: str):
+        """Serializes /api/like for one image (lookup, vote check, DB/storage writes); other images proceed."""
+        entry = self._hash_locks.setdefault(img_hash, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._hash_locks.pop(img_hash, None)
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            await self.refresh()
+
+    @property
+    def count(self) -> int:
+        return len(self._rows)
+
+    def pop_overflow(self) -> List[Dict]:
+        """Drop the oldest rows beyond the cap; the caller deletes them from the DB."""
+        evicted = []
+        while len(self._rows) > self.limit:
+            evicted.append(self.pop_oldest())
+        return evicted
+
+    def get(self, img_hash: str) -> Optional[Dict]:
+        return self._rows.get(img_hash)
+
+    def get_by_id(self, row_id) -> Optional[Dict]:
+        img_hash = self._hash_by_id.get(str(row_id))
+        return self._rows.get(img_hash) if img_hash else None
+
+    def add(self, row: Dict):
+        img_hash = row["image_hash"]
+        self._writes += 1
+        self._rows[img_hash] = row
+        self._rows.move_to_end(img_hash)
+        self._hash_by_id[str(row["id"])] = img_hash
+
+    def update(self, img_hash: str, fields: Dict, bump: bool = False):
+        row = self._rows.get(img_hash)
+        if row is None: return
+        self._writes += 1
+        row.update(fields)
+        if bump:  # created_at reset to now() -> becomes the newest row
+            self._rows.move_to_end(img_hash)
+
+    def pop_oldest(self) -> Optional[Dict]:
+        if not self._rows: return None
+        self._writes += 1
+        _, row = self._rows.popitem(last=False)
+        self._hash_by_id.pop(str(row.get("id")), None)
+        return row
+
+hall_of_fame = HallOfFameIndex()
+
+async def evict_hall_of_fame_row(row: Dict):
+    """Remove an evicted row and its blobs. Runs after the response is sent."""
     try:
-        return supabase.table("images").insert(payload).execute()
-    except Exception as exc:
-        if "source_type" in payload and should_retry_without_source_type(exc):
-            fallback = dict(payload)
-            fallback.pop("source_type", None)
-            return supabase.table("images").insert(fallback).execute()
-        raise
-
-def update_image_row(row_id: str, payload: Dict):
+        paths = [p for p in (row.get('storage_path'), row.get('thumb_path'), row.get('preview_path')) if p]
+        try: await repo.remove_blobs(paths)
+        except: pass
+        await repo.delete_image(row['id'])
+        logger.info(f"Hall of Fame Evicted: {row['id']}")
+    except Exception as e:
+        logger.error(f"Eviction Error: {e}")
+
+async def store_hall_of_fame_variants(row_id, img_hash: str, content: bytes):
+    """Generate WebP thumbnail/preview variants in the worker pool and attach them to the row."""
     try:
-        return supabase.table("images").update(payload).eq("id", row_id).execute()
-    except Exception as exc:
-        if "source_type" in payload and should_retry_without_source_type(exc):
-            fallback = dict(payload)
-            fallback.pop("source_type", None)
-            return supabase.table("images").update(fallback).eq("id", row_id).execute()
-        raise
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(variant_pool, make_webp_variants, content)
+        update_payload = {}
+        for name, data in variants.items():
+            path = variant_path(img_hash, name)
+            await repo.upload_blob(path, data, "image/webp", upsert=True)
+            update_payload[f"{name}_path"] = path
+        if update_payload:
+            await repo.update_image(str(row_id), update_payload)
+            hall_of_fame.update(img_hash, update_payload)
+            logger.info(f"Hall of Fame Variants Stored: {row_id} ({', '.join(variants)})")
+    except Exception as e:
+        # Trending falls back to the original image
+        logger.error(f"Variant Error: {e}")
+
+# --- 3c. ARTIFACT STORE (Recently Extracted Image Bytes) ---
+ARTIFACT_TTL_SECONDS = 30 * 60
+ARTIFACT_MAX_BYTES = 256 * 1024 * 1024
+
+class ArtifactStore:
+    """
+    Short-lived sha256 -> image bytes store filled during extraction, so /api/like
+    can reference an image by hash instead of the client re-uploading it.
+    Bounded by TTL and total bytes (least recently stored entries go first).
+    Extraction runs in the threadpool, hence the lock.
+    """
+    def __init__(self, ttl: int = ARTIFACT_TTL_SECONDS, max_bytes: int = ARTIFACT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()  # hash -> (bytes, ext, expires_at)
+        self._lock = threading.Lock()
+
+    def put(self, img_hash: str, data: bytes, ext: str):
+        if len(data) > self.max_bytes: return
+        with self._lock:
+            if img_hash in self._items:
+                self._drop(img_hash)
+            self._items[img_hash] = (data, ext, time.time() + self.ttl)
+            self.total_bytes += len(data)
+            self._evict()
+
+    def get(self, img_hash: str) -> Optional[tuple]:
+        """Returns (bytes, ext) or None if unknown/expired."""
+        with self._lock:
+            item = self._items.get(img_hash)
+            if item is None: return None
+            if item[2] < time.time():
+                self._drop(img_hash)
+                return None
+            return item[0], item[1]
+
+    def _drop(self, img_hash: str):
+        data, _, _ = self._items.pop(img_hash)
+        self.total_bytes -= len(data)
+
+    def _evict(self):
+        now = time.time()
+        while self._items:
+            oldest_hash, (data, _, expires_at) = next(iter(self._items.items()))
+            if expires_at >= now and self.total_bytes <= self.max_bytes:
+                break
+            self._drop(oldest_hash)
+
+artifact_store = ArtifactStore()
 
 # --- 4. LIFESPAN & SCHEDULER ---
 scheduler = AsyncIOScheduler()
 
 async def cleanup_old_data():
     """Janitor: High Watermark Strategy."""
-    if not supabase: return
+    if not repo: return
     try:
-        count_res = supabase.table("chats").select("id", count="exact", head=True).execute()
-        current_count = count_res.count
+        current_count = await repo.count_chats()
         limit = 500000
         shrink_target = 250000
         
         if current_count > limit:
             logger.info("Janitor running cleanup")
-            res = supabase.table("chats").select("id").order("id", desc=True).range(shrink_target, shrink_target).limit(1).execute()
-            if res.data:
-                cutoff_id = res.data[0]['id']
-                supabase.table("chats").delete().lt("id", cutoff_id).execute()
+            cutoff_id = await repo.chat_id_at_offset(shrink_target)
+            if cutoff_id:
+                await repo.delete_chats_before(cutoff_id)
     except Exception as e:
         logger.error(f"Janitor Error: {e}")
 
+async def refresh_hall_of_fame():
+    """Re-sync the Hall of Fame index with the DB (picks up janitor/manual edits)."""
+    try:
+        await hall_of_fame.refresh()
+    except Exception as e:
+        logger.error(f"Hall of Fame Refresh Error: {e}")
+
 async def keep_alive_ping():
     """Self-ping to stay awake on HF Spaces."""
     try:
@@ -225,8 +398,8 @@ async def keep_alive_ping():
         # Internal pinging doesn't always work for HF sleeping, 
         # but it keeps the internal async loop active and healthy.
         import requests
-        # Simple head request to root
-        requests.get("http://localhost:7860", timeout=5)
+        # Simple head request to root (off the loop: requests is blocking)
+        await run_in_threadpool(requests.get, "http://localhost:7860", timeout=5)
         logger.info("Keep-alive ping sent.")
     except:
         pass
@@ -234,12 +407,30 @@ async def keep_alive_ping():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    scheduler.add_job(cleanup_old_data, 'interval', minutes=10)
-    scheduler.add_job(keep_alive_ping, 'interval', minutes=30) # Ping every 30m
+    loop_monitor.start()
+    scheduler.add_job(loop_monitor.track("job cleanup_old_data", cleanup_old_data), 'interval', minutes=10)
+    scheduler.add_job(loop_monitor.track("job keep_alive_ping", keep_alive_ping), 'interval', minutes=30) # Ping every 30m
+    scheduler.add_job(loop_monitor.track("job refresh_hall_of_fame", refresh_hall_of_fame), 'interval', minutes=5)
+    if repo:
+        await refresh_hall_of_fame()
     scheduler.start()
+    if repo:
+        await manager._load_persisted_data()
+    await manager.backend.start(manager.handle_event)
+    leaderboard_ticker = asyncio.create_task(manager.leaderboard_tick_loop())
+    persistence_writer = asyncio.create_task(manager.persistence.run())
     yield
     # Shutdown
+    leaderboard_ticker.cancel()
+    manager.persistence.stop()
+    try:
+        await persistence_writer  # Don't lose the last batch (nor one swapped out mid-flush)
+    except Exception as e:
+        logger.error(f"Persistence writer failed: {e}")
+        await manager.persistence.flush()
+    await manager.backend.stop()
     scheduler.shutdown()
+    loop_monitor.stop()
 
 app = FastAPI(lifespan=lifespan, 
               docs_url=None if settings.current_env == "production" else "/docs",  # Hide docs in prod
@@ -316,6 +507,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Names the route/WebSocket behind event-loop stalls (see loop_monitor.py)
+app.add_middleware(LoopActivityMiddleware)
+# Request time + response size per route for /metrics
+app.add_middleware(metrics.HttpMetricsMiddleware)
+# Peak payload bytes held per request (memory_ledger.py)
+app.add_middleware(memory_ledger.MemoryLedgerMiddleware)
+# Per-stage Server-Timing header (+ JSON log for requests over SLOW_REQUEST_LOG_SECONDS)
+app.add_middleware(tracing.ServerTimingMiddleware)
+
 # --- 6. ERROR HANDLERS (No Information Leakage) ---
 @app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request, exc):
@@ -344,70 +544,247 @@ async def global_exception_handler(request, exc):
 
 
 # --- 7. WEBSOCKET MANAGER ---
+WS_SEND_QUEUE_SIZE = 256  # Messages buffered per socket before it counts as a slow consumer
+WS_SEND_TIMEOUT = 10      # Seconds a single send may take before the socket is dropped
+ONLINE_COUNT_DEBOUNCE_SECONDS = 0.5  # Connect storms collapse into one online_count broadcast
+LEADERBOARD_TICK_SECONDS = 0.25  # Coalescing window for leaderboard deltas
+
+class ClientConnection:
+    """Outbound side of one socket: a bounded queue drained by a dedicated writer task."""
+    def __init__(self, websocket: WebSocket, on_dead, leaderboard_deltas: bool = False, encoding: str = ENCODING_JSON):
+        self.websocket = websocket
+        self.encoding = encoding  # Wire format, see ws_protocol.py
+        # Delta clients get 'leaderboard_delta' ticks instead of the full board on every event
+        self.leaderboard_deltas = leaderboard_deltas
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self._on_dead = on_dead
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"WS writer stopped: {e}")
+            self._on_dead(self.websocket)
+
+    async def close(self):
+        self.writer.cancel()
+        try: await self.websocket.close()
+        except: pass
+
+PERSIST_BATCH_SIZE = 100          # Flush early once this many chats are pending
+PERSIST_FLUSH_SECONDS = 2.0       # Otherwise flush on this interval
+PERSIST_MAX_PENDING = 5000        # Oldest unsaved chats are dropped beyond this (DB outage)
+LEADERBOARD_REFRESH_SECONDS = 60  # How often the authoritative board is re-read from the DB
+CHAT_RING_SIZE = 500              # Hot tail of chat history kept in memory (serves /api/chat/history)
+INIT_HISTORY_SIZE = 20            # Messages replayed in 'init'; older ones are fetched on scroll
+
+class PersistenceQueue:
+    """
+    Write-behind buffer for chats and leaderboard stats.
+    Chats become one bulk insert per flush; score/chat increments are summed per country
+    and applied in one atomic increment call, instead of ~4 round trips per message.
+    """
+    def __init__(self, on_leaderboard_refresh, on_chat_ids):
+        self._chats: List[Dict] = []
+        self._uids: List[str] = []  # Parallel to _chats: the broadcast uid of each pending chat
+        self._increments: Dict[str, List[int]] = {}  # country -> [score_inc, chat_inc]
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._on_leaderboard_refresh = on_leaderboard_refresh
+        self._on_chat_ids = on_chat_ids
+        self._last_refresh = time.time()
+
+    def add_chat(self, country: str, msg: str, uid: str):
+        self._chats.append({"country": country, "msg": msg[:500]})  # Truncate long messages
+        self._uids.append(uid)
+        if len(self._chats) > PERSIST_MAX_PENDING:
+            del self._chats[:len(self._chats) - PERSIST_MAX_PENDING]
+            del self._uids[:len(self._uids) - PERSIST_MAX_PENDING]
+        self.add_stats(country, chat_inc=1)
+        if len(self._chats) >= PERSIST_BATCH_SIZE:
+            self._wakeup.set()
+
+    def add_stats(self, country: str, score_inc: int = 0, chat_inc: int = 0):
+        inc = self._increments.setdefault(country, [0, 0])
+        inc[0] += score_inc
+        inc[1] += chat_inc
+
+    def pending_increments(self) -> Dict[str, List[int]]:
+        """Increments not yet written (queued since the last flush, or re-queued after a failure)."""
+        return {country: list(inc) for country, inc in self._increments.items()}
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=PERSIST_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            await self.flush()
+        await self.flush()  # Last batch, written after any flush that was in flight
+
+    def stop(self):
+        """Ask run() to write the last batch and return; await its task instead of cancelling it."""
+        self._stopping = True
+        self._wakeup.set()
+
+    async def flush(self):
+        if not repo: return
+        chats, self._chats = self._chats, []
+        uids, self._uids = self._uids, []
+        increments, self._increments = self._increments, {}
+        # Chats and stats retry independently: a failed stats write must not re-insert chats
+        if chats:
+            try:
+                ids = await repo.insert_chats(chats)
+            except Exception as e:
+                logger.error(f"Persist Error (chats): {e}")
+                # Put them back in front of anything queued meanwhile; retried next flush
+                self._chats[:0] = chats
+                self._uids[:0] = uids
+            else:
+                if ids:
+                    await self._on_chat_ids(dict(zip(uids, ids)))
+        if increments:
+            try:
+                await repo.apply_leaderboard_increments(increments)
+            except Exception as e:
+                logger.error(f"Persist Error (leaderboard): {e}")
+                for country, (score_inc, chat_inc) in increments.items():
+                    self.add_stats(country, score_inc, chat_inc)
+        if time.time() - self._last_refresh >= LEADERBOARD_REFRESH_SECONDS:
+            self._last_refresh = time.time()
+            await self._on_leaderboard_refresh()
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
         self.connection_countries: Dict[WebSocket, str] = {}
-        self.chat_history = deque(maxlen=50) 
-        self.leaderboard_cache = [] 
-        
-        if supabase:
-            self._load_data_from_supabase()
-
-    def _load_data_from_supabase(self):
-        if not supabase: return
+        self.country_counts: Dict[str, int] = {}  # country -> live connections, kept in step with connection_countries
+        self._online_count_task: Optional[asyncio.Task] = None
+        self.chat_history = deque(maxlen=CHAT_RING_SIZE)  # Oldest first; entries get an "id" once persisted
+        self._unpersisted_chats: "OrderedDict[str, Dict]" = OrderedDict()  # uid -> history entry awaiting its DB id
+        self.leaderboard_cache = []  # Ordered by score desc
+        self._leaderboard_pos: Dict[str, int] = {}  # country -> index into leaderboard_cache
+        # Countries changed / dropped off the board since the last tick
+        self._dirty_countries = set()
+        self._removed_countries = set()
+        self.persistence = PersistenceQueue(self._update_leaderboard_cache, self._publish_chat_ids)
+        self.backend = create_broadcast_backend(settings.broadcast_url)
+        self.online_total = 0  # Connections across all workers, from the last presence update
+
+
+    async def _load_persisted_data(self):
+        """Called once at startup (lifespan)."""
+        if not repo: return
         try:
-            logger.info("Loading recent chats from Supabase...")
-            response = supabase.table("chats").select("*").order("created_at", desc=True).limit(50).execute()
+            logger.info(f"Loading recent chats from {repo.name}...")
+            rows = await repo.recent_chats(CHAT_RING_SIZE)
             
             # Reset history to avoid dupes on reload
             self.chat_history.clear()
             
-            for row in reversed(response.data):
+            for row in reversed(rows):
                 self.chat_history.append({
+                    "id": row["id"],
                     "country": row.get("country", "Unknown"),
                     "msg": row.get("msg", ""), # Sanitize on render
                     "type": "chat"
                 })
             logger.info(f"Loaded {len(self.chat_history)} messages.")
-            self._update_leaderboard_cache()
+            await self._update_leaderboard_cache()
         except Exception as e:
-            logger.error(f"Supabase Load Error: {e}")
+            logger.error(f"History Load Error: {e}")
 
-    def _update_leaderboard_cache(self):
-        if not supabase: return
+    async def _update_leaderboard_cache(self):
+        if not repo: return
         try:
-            res = supabase.table("leaderboard").select("*").order("score", desc=True).limit(50).execute()
-            self.leaderboard_cache = [
+            rows = await repo.top_leaderboard(50)
+            fresh = [
                 {
                     "country": row.get("country"),
                     "score": row.get("score", 0),
                     "chats": row.get("chat_count", 0)
                 }
-                for row in res.data
+                for row in rows
             ]
+            previous = {item["country"]: item for item in self.leaderboard_cache}
+            changed = {item["country"] for item in fresh if previous.get(item["country"]) != item}
+            removed = set(previous) - {item["country"] for item in fresh}
+            self._set_leaderboard(fresh)
+            self._mark_dirty(*changed)
+            self._mark_removed(*removed)
+            # DB rows lack what this worker has not flushed yet; re-apply it so its own increments don't
+            # vanish. Other workers' unflushed increments aren't visible here, so with several workers
+            # a score can still dip until they flush.
+            for country, (score_inc, chat_inc) in self.persistence.pending_increments().items():
+                self._update_cache_optimistically(country, score_inc, chat_inc)
         except Exception as e:
             logger.error(f"Leaderboard Load Error: {e}")
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        self.connection_countries[websocket] = "Unknown"
+    async def connect(self, websocket: WebSocket, leaderboard_deltas: bool = False, encoding: str = ENCODING_JSON):
+        requested = websocket.scope.get("subprotocols") or []
+        await websocket.accept(subprotocol=COMPACT_SUBPROTOCOL if COMPACT_SUBPROTOCOL in requested else None)
         # Validate message sizes? handled by FastAPI default buffer limits usually
         
-        await websocket.send_json({
+        # Sent directly so it always precedes queued broadcasts
+        tail = list(self.chat_history)[-INIT_HISTORY_SIZE:]
+        await websocket.send_text(encode_message({
             "type": "init", 
-            "online": len(self.active_connections),
+            "online": max(self.online_total, len(self.active_connections)) + 1,
             "leaderboard": self.leaderboard_cache,
-            "history": list(self.chat_history)
-        })
-        await self.broadcast_online_count()
+            "history": [{"type": "chat", "country": m.get("country"), "msg": m.get("msg")} for m in tail],
+            "history_before": self._history_cursor(len(tail)),
+        }, encoding))
+        self.active_connections[websocket] = ClientConnection(websocket, self._evict, leaderboard_deltas, encoding)
+        metrics.WS_CONNECTS.inc()
+        self._set_connection_country(websocket, "Unknown")
+        self.request_online_count()
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if websocket in self.connection_countries:
-            del self.connection_countries[websocket]
+        client = self.active_connections.pop(websocket, None)
+        if client is not None:
+            client.writer.cancel()
+        self._set_connection_country(websocket, None)
+
+    def _evict(self, websocket: WebSocket):
+        """Drop a slow or broken consumer without blocking the caller."""
+        client = self.active_connections.pop(websocket, None)
+        self._set_connection_country(websocket, None)
+        if client is None: return
+        logger.warning("WS client evicted (slow consumer or send error)")
+        asyncio.create_task(client.close())
+        self.request_online_count()
+
+    def _set_connection_country(self, websocket: WebSocket, country: Optional[str]):
+        """Move a connection between country buckets (None removes it)."""
+        previous = self.connection_countries.pop(websocket, None)
+        if previous is not None:
+            remaining = self.country_counts[previous] - 1
+            if remaining: self.country_counts[previous] = remaining
+            else: del self.country_counts[previous]
+        if country is not None:
+            self.connection_countries[websocket] = country
+            self.country_counts[country] = self.country_counts.get(country, 0) + 1
+
+    def send_personal(self, websocket: WebSocket, message: dict):
+        client = self.active_connections.get(websocket)
+        if client and not client.enqueue(encode_message(message, client.encoding)):
+            self._evict(websocket)
 
     async def set_country(self, websocket: WebSocket, country: str):
         if websocket not in self.connection_countries: return
@@ -416,80 +793,199 @@ class ConnectionManager:
             return # Ignore invalid country codes
         
         if self.connection_countries[websocket] != country:
-            self.connection_countries[websocket] = country
-            await self.broadcast_online_count()
+            self._set_connection_country(websocket, country)
+            self.request_online_count()
 
-    async def broadcast_online_count(self):
-        dist = Counter(self.connection_countries.values())
-        dist_str = ", ".join([f"{k}: {v}" for k, v in dist.items() if k != "Unknown"])
-        if not dist_str: dist_str = "Unknown"
-        await self.broadcast_internal({ "type": "online_count",  "count": len(self.active_connections), "distribution": dist_str })
+    def request_online_count(self):
+        """Schedule one online_count broadcast; calls within the debounce window are merged."""
+        if self._online_count_task is None or self._online_count_task.done():
+            self._online_count_task = asyncio.create_task(self._debounced_online_count())
 
-    def _update_cache_optimistically(self, country, score_inc=0, chat_inc=0):
-        found = False
-        for item in self.leaderboard_cache:
-            if item["country"] == country:
-                item["score"] += score_inc
-                item["chats"] += chat_inc
-                found = True
-                break
-        if not found:
-            self.leaderboard_cache.append({ "country": country, "score": score_inc, "chats": chat_inc })
-        self.leaderboard_cache.sort(key=lambda x: x["score"], reverse=True)
+    async def _debounced_online_count(self):
+        await asyncio.sleep(ONLINE_COUNT_DEBOUNCE_SECONDS)
+        try:
+            # Every worker re-broadcasts the global count when it sees the presence event
+            await self.backend.set_presence(self.country_counts)
+        except Exception as e:
+            logger.error(f"Presence Error: {e}")
+            await self.broadcast_online_count(self.country_counts)
+
+    async def broadcast_online_count(self, counts: Optional[Dict[str, int]] = None):
+        if counts is None:
+            counts = await self.backend.get_presence()
+        self.online_total = sum(counts.values())
+        dist_str = ", ".join([f"{k}: {v}" for k, v in counts.items() if k != "Unknown"])
+        if not dist_str: dist_str = "Unknown"
+        await self.broadcast_internal({ "type": "online_count",  "count": self.online_total, "distribution": dist_str })
+
+    def _history_cursor(self, tail_size: int) -> Optional[int]:
+        """Keyset cursor for messages older than the last `tail_size` entries (None = nothing older known)."""
+        history = self.chat_history
+        for i in range(len(history) - tail_size, len(history)):
+            if history[i].get("id"):
+                return history[i]["id"]
+        # Whole tail still unpersisted: continue from the newest persisted message before it
+        for i in range(len(history) - tail_size - 1, -1, -1):
+            if history[i].get("id"):
+                return history[i]["id"] + 1
+        return None
+
+    def get_history_page(self, before: Optional[int], limit: int) -> Optional[List[Dict]]:
+        """Serve a page from the in-memory ring, or None if it does not cover the request."""
+        page = [m for m in self.chat_history if m.get("id") and (before is None or m["id"] < before)]
+        if len(page) < limit:
+            return None
+        return page[-limit:]
+
+    async def _publish_chat_ids(self, ids: Dict[str, int]):
+        try:
+            await self.backend.publish({"type": "chat_ids", "ids": ids})
+        except Exception as e:
+            logger.error(f"Publish Error: {e}")
+            await self.handle_event({"type": "chat_ids", "ids": ids})
 
-    async def broadcast(self, message: dict):
-        await self.broadcast_internal(message)
-        if supabase:
-            await run_in_threadpool(self._persist_message, message)
+    def _set_leaderboard(self, items: List[Dict]):
+        self.leaderboard_cache = items
+        self._leaderboard_pos = {item["country"]: i for i, item in enumerate(items)}
 
-    async def broadcast_internal(self, message: dict):
-        for connection in self.active_connections:
+    def _update_cache_optimistically(self, country, score_inc=0, chat_inc=0):
+        board = self.leaderboard_cache
+        pos = self._leaderboard_pos.get(country)
+        if pos is None:
+            pos = len(board)
+            board.append({ "country": country, "score": 0, "chats": 0 })
+            self._leaderboard_pos[country] = pos
+        item = board[pos]
+        item["score"] += score_inc
+        item["chats"] += chat_inc
+        # Scores only grow, so the entry can only move up; bubble it past lower scores
+        while pos > 0 and board[pos - 1]["score"] < item["score"]:
+            board[pos - 1], board[pos] = item, board[pos - 1]
+            self._leaderboard_pos[board[pos]["country"]] = pos
+            pos -= 1
+        self._leaderboard_pos[country] = pos
+        self._mark_dirty(country)
+
+    def _mark_dirty(self, *countries):
+        self._dirty_countries.update(countries)
+        self._removed_countries.difference_update(countries)
+
+    def _mark_removed(self, *countries):
+        self._removed_countries.update(countries)
+        self._dirty_countries.difference_update(countries)
+
+    async def leaderboard_tick_loop(self):
+        """Coalesce leaderboard changes into one 'leaderboard_delta' per tick for delta clients."""
+        while True:
+            await asyncio.sleep(LEADERBOARD_TICK_SECONDS)
+            if not self._dirty_countries and not self._removed_countries: continue
+            dirty, self._dirty_countries = self._dirty_countries, set()
+            removed, self._removed_countries = self._removed_countries, set()
             try:
-                await connection.send_json(message)
-            except:
-                pass
+                entries = [item for item in self.leaderboard_cache if item["country"] in dirty]
+                if entries or removed:
+                    delta = {"type": "leaderboard_delta", "entries": entries}
+                    if removed:
+                        delta["removed"] = sorted(removed)  # Fell out of the top 50 on a refresh
+                    await self.broadcast_internal(delta, only=lambda client: client.leaderboard_deltas)
+            except Exception as e:
+                logger.error(f"Leaderboard Tick Error: {e}")
 
-    def _persist_message(self, message: dict):
+    async def broadcast(self, message: dict):
+        """Publish a client event to every worker; only the receiving worker persists it."""
+        if message.get("type") == "chat":
+            message["uid"] = uuid.uuid4().hex[:12]  # Links the history entry to its DB id after the flush
+        self._persist_message(message)
+        message["sent_at"] = time.time()  # Broadcast latency, measured where the event is fanned out
         try:
-            msg = message.get("msg")
-            if msg == "🛑 Slow down!": return # Don't persist system warning
-            
-            msg_type = message.get("type")
-            country = message.get("country", "Unknown")
-            
-            if msg_type == "chat":
-                if len(msg) > 500: msg = msg[:500] # Truncate long messages
-                supabase.table("chats").insert({"country": country, "msg": msg}).execute()
-                self._upsert_stats(country, chat_inc=1)
-                self.chat_history.append(message)
-
-            elif msg_type == "update_score":
-                self._upsert_stats(country, score_inc=1)
-                
-            self._update_leaderboard_cache()
+            await self.backend.publish(message)
         except Exception as e:
-            logger.error(f"Persist Error: {e}")
+            logger.error(f"Publish Error: {e}")
+            await self.handle_event(message)  # Broker down: at least reach local sockets
+
+    async def handle_event(self, event: dict):
+        """Apply an event from the broadcast backend to local state and local sockets."""
+        sent_at = event.pop("sent_at", None)
+        event_type = event.get("type")
+        if event_type == "presence":
+            await self.broadcast_online_count()
+            return
+        if event_type == "chat_ids":
+            for uid, chat_id in event.get("ids", {}).items():
+                entry = self._unpersisted_chats.pop(uid, None)
+                if entry is not None: entry["id"] = chat_id
+            return
+
+        country = event.get("country", "Unknown")
+        if event_type == "chat":
+            self._update_cache_optimistically(country, chat_inc=1)
+            entry = {"type": "chat", "country": country, "msg": event.get("msg")}
+            self.chat_history.append(entry)
+            if event.get("uid"):
+                self._unpersisted_chats[event["uid"]] = entry
+                if len(self._unpersisted_chats) > CHAT_RING_SIZE:
+                    self._unpersisted_chats.popitem(last=False)
+            event = {"type": "chat", "country": country, "msg": event.get("msg")}
+        elif event_type == "update_score":
+            self._update_cache_optimistically(country, score_inc=1)
+        else:
+            await self.broadcast_internal(event)
+            return
+
+        # Legacy clients still expect the full board on every event
+        await self.broadcast_internal(
+            {**event, "leaderboard": self.leaderboard_cache},
+            only=lambda client: not client.leaderboard_deltas
+        )
+        await self.broadcast_internal(event, only=lambda client: client.leaderboard_deltas)
+        if sent_at:
+            metrics.WS_BROADCAST_SECONDS.observe(max(0.0, time.time() - sent_at), event=event_type)
+
+    async def broadcast_internal(self, message: dict, only=None):
+        # Serialize once per encoding, then hand off to each writer; never awaits a socket
+        targets = [(ws, client) for ws, client in self.active_connections.items() if only is None or only(client)]
+        if not targets: return
+        encoded: Dict[str, str] = {}
+        overflowed = []
+        for ws, client in targets:
+            text = encoded.get(client.encoding)
+            if text is None:
+                text = encoded[client.encoding] = encode_message(message, client.encoding)
+            if not client.enqueue(text):
+                overflowed.append(ws)
+        for ws in overflowed:
+            metrics.WS_EVICTIONS.inc()
+            self._evict(ws)
 
-    def _upsert_stats(self, country, score_inc=0, chat_inc=0):
-        try:
-            res = supabase.table("leaderboard").select("*").eq("country", country).execute()
-            if res.data:
-                curr = res.data[0]
-                new_score = curr['score'] + score_inc
-                new_chats = curr['chat_count'] + chat_inc
-                supabase.table("leaderboard").update({"score": new_score, "chat_count": new_chats}).eq("country", country).execute()
-            else:
-                supabase.table("leaderboard").insert({"country": country, "score": score_inc, "chat_count": chat_inc}).execute()
-        except:
-            pass
+    def _persist_message(self, message: dict):
+        """Queue the DB write; it happens in the next PersistenceQueue flush."""
+        if not repo: return
+        msg = message.get("msg")
+        if msg == "🛑 Slow down!": return # Don't persist system warning
+        
+        msg_type = message.get("type")
+        country = message.get("country", "Unknown")
+        
+        if msg_type == "chat":
+            self.persistence.add_chat(country, msg, message["uid"])
+
+        elif msg_type == "update_score":
+            self.persistence.add_stats(country, score_inc=1)
 
 manager = ConnectionManager()
+metrics.WS_CONNECTIONS.set_function(lambda: len(manager.active_connections))
 
 # --- 8. ROUTES ---
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    # ?lb=delta opts into coalesced leaderboard deltas (see ConnectionManager.leaderboard_tick_loop)
+    # ?enc=compact (or the pp.compact.v1 subprotocol) selects the positional wire format
+    await manager.connect(
+        websocket,
+        leaderboard_deltas=websocket.query_params.get("lb") == "delta",
+        encoding=negotiate_encoding(websocket.query_params.get("enc"), websocket.scope.get("subprotocols")),
+    )
     last_msg_time = 0
     msg_burst_count = 0
     burst_window_start = time.time()
@@ -506,7 +1002,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 burst_window_start = now
             msg_burst_count += 1
             if msg_burst_count > 10:
-                await websocket.send_json({"type": "chat", "country": "System", "msg": "🛑 Slow down!"})
+                manager.send_personal(websocket, {"type": "chat", "country": "System", "msg": "🛑 Slow down!"})
                 continue
             last_msg_time = now
             
@@ -521,54 +1017,62 @@ async def websocket_endpoint(websocket: WebSocket):
                 msg = str(data.get("msg", "")).strip()
                 if msg:
                     # Basic Content Filter? (Optional)
-                    manager._update_cache_optimistically(country, chat_inc=1)
                     await manager.broadcast({
                         "type": "chat",
                         "country": country,
                         "msg": msg[:300], # Max 300 chars
-                        "leaderboard": manager.leaderboard_cache
                     })
             elif msg_type == "score":
-                manager._update_cache_optimistically(country, score_inc=1)
                 await manager.broadcast({
                     "type": "update_score",
                     "country": country,
-                    "leaderboard": manager.leaderboard_cache
                 })
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
-        await manager.broadcast_online_count()
+        manager.request_online_count()
     except Exception as e:
         logger.error(f"WS Error: {e}")
+        manager.disconnect(websocket)
+        manager.request_online_count()
         try:
              await websocket.close()
         except: pass
 
 @app.post("/api/process")
-async def process_doi(req: DoiRequest): # Validated by Pydantic
+async def process_doi(req: DoiRequest, request: Request): # Validated by Pydantic
     try:
-        logger.info(f"Processing DOI: {req.doi}") # Audit
-        logger.info("Starting Sci-Hub download...")
-        pdf_bytes, title, metadata = await run_in_threadpool(get_pdf_from_scihub_advanced, req.doi)
-        logger.info(f"Download Finished. Title: {title[:50]}...")
-        
-        if not pdf_bytes:
-             logger.warning(f"PDF Not Found: {req.doi}")
-             raise HTTPException(status_code=404, detail=result_msg)
-        
-        logger.info(f"PDF Downloaded ({len(pdf_bytes)} bytes). Starting extraction...")
-        result = await run_in_threadpool(extract_from_bytes, pdf_bytes)
-        logger.info(f"Extraction Finished. Status: {result.get('status')}")
-        
-        if result["status"] == "success":
-            result["doi"] = req.doi
-            result["source_type"] = "doi"
-            result["pdf_base64"] = base64.b64encode(pdf_bytes).decode('utf-8')
-            result["meta"] = metadata # Pass metadata to frontend
-            return result
-        else:
-            raise HTTPException(status_code=400, detail=result.get("detail", "Processing failed"))
+        # One budget for the whole request: fetch timeouts shrink to what is left, extraction stops early
+        with deadline.budget() as budget:
+            logger.info(f"Processing DOI: {req.doi}") # Audit
+            logger.info("Starting Sci-Hub download...")
+            pdf_bytes, title, metadata = await run_in_threadpool(get_pdf_from_scihub_advanced, req.doi)
+            logger.info(f"Download Finished. Title: {title[:50]}...")
+
+            if not pdf_bytes:
+                 logger.warning(f"PDF Not Found: {req.doi} (cut short: {budget.cut_short})")
+                 if budget.cut_short:
+                     raise HTTPException(status_code=504, detail="Time budget ran out before a PDF was found")
+                 raise HTTPException(status_code=404, detail=title)
+
+            logger.info(f"PDF Downloaded ({len(pdf_bytes)} bytes). Starting extraction...")
+            memory_ledger.hold(len(pdf_bytes))
+            result, profile_id = await run_in_threadpool(
+                profile_call, "extract_from_bytes", extract_from_bytes, pdf_bytes, force=is_admin(request.headers.get("X-Profile"))
+            )
+            logger.info(f"Extraction Finished. Status: {result.get('status')}")
+
+            if result["status"] == "success":
+                result["doi"] = req.doi
+                result["source_type"] = "doi"
+                result["pdf_base64"] = Base64Blob(pdf_bytes)  # Encoded while the body streams
+                result["meta"] = metadata # Pass metadata to frontend
+                result["deadline"] = budget.report()
+                return _stream_json(result, profile_id)
+            elif result["status"] == "timeout":
+                raise HTTPException(status_code=504, detail=result["detail"])
+            else:
+                raise HTTPException(status_code=400, detail=result.get("detail", "Processing failed"))
 
     except HTTPException as e:
         raise e
@@ -577,7 +1081,7 @@ async def process_doi(req: DoiRequest): # Validated by Pydantic
         raise HTTPException(status_code=500, detail="Processing error")
 
 @app.post("/api/upload")
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(request: Request, file: UploadFile = File(...)):
     # Validate Extension
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files allowed")
@@ -591,11 +1095,14 @@ async def upload_pdf(file: UploadFile = File(...)):
         # Size limit check? (FastAPI limits strictly config based, but explicit check good)
         if len(contents) > 300 * 1024 * 1024: # 300MB
              raise HTTPException(status_code=413, detail="File too large (Max 300MB)")
+        memory_ledger.hold(len(contents))
 
-        result = await run_in_threadpool(extract_from_bytes, contents)
+        result, profile_id = await run_in_threadpool(
+            profile_call, "extract_from_bytes", extract_from_bytes, contents, force=is_admin(request.headers.get("X-Profile"))
+        )
         if result.get("status") == "success":
             result["source_type"] = "pdf_upload"
-        return result
+        return _stream_json(result, profile_id)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -605,12 +1112,14 @@ async def upload_pdf(file: UploadFile = File(...)):
 @app.post("/api/like")
 async def like_image(
     request: Request,
-    file: UploadFile = File(...),
+    background_tasks: BackgroundTasks,
+    file: Optional[UploadFile] = File(None),
+    image_hash: Optional[str] = Form(None),
     doi: str = Form(...),
     source_type: str = Form("pdf_upload"),
     country: str = Form("Unknown")
 ):
-    if not supabase:
+    if not repo:
         raise HTTPException(status_code=503, detail="Database unavailable")
 
     forwarded = request.headers.get("X-Forwarded-For")
@@ -620,100 +1129,118 @@ async def like_image(
         clean_doi = normalize_hall_of_fame_doi(doi)
         clean_source_type = normalize_hall_of_fame_source_type(source_type, clean_doi)
 
-        # Validate File
-        if not file.content_type.startswith("image/"):
-             raise HTTPException(status_code=400, detail="Invalid image file")
+        content = None
+        if file is not None:
+            # Validate File
+            if not file.content_type.startswith("image/"):
+                 raise HTTPException(status_code=400, detail="Invalid image file")
 
-        content = await file.read()
-        import hashlib
-        img_hash = hashlib.sha256(content).hexdigest()
+            content = await file.read()
+            img_hash = hashlib.sha256(content).hexdigest()
+            content_type = file.content_type
+            file_ext = file.filename.split('.')[-1].lower() if '.' in file.filename else "png"
+        elif image_hash and re.match(r'^[0-9a-f]{64}$', image_hash):
+            # Like-by-reference: bytes were kept from the extraction that produced this hash
+            img_hash = image_hash
+        else:
+            raise HTTPException(status_code=400, detail="Image file or hash required")
         
-        # Check DB
-        res = supabase.table("images").select("*").eq("image_hash", img_hash).execute()
+        # Serialized per image: its index lookup and the writes it leads to must not interleave across awaits
+        async with hall_of_fame.hash_lock(img_hash):
+            # Check Index (DB round trip only on a miss)
+            await hall_of_fame.ensure_loaded()
+            existing_row = hall_of_fame.get(img_hash)
+            if not existing_row:
+                # Another worker may have inserted it since our index loaded; one indexed lookup before uploading
+                existing_row = await repo.find_image_by_hash(img_hash)
+                if existing_row:
+                    hall_of_fame.add(existing_row)
         
-        if res.data:
-            existing_row = res.data[0]
-            row_id = existing_row['id']
-            if vote_manager.has_voted(row_id, client_ip):
-                  # Return success state but normalized to act like nothing happened
-                 return {"status": "success", "msg": "Already in Hall of Fame!", "likes": existing_row['likes'], "id": row_id}
-
-            new_likes = existing_row['likes'] + 1
-            update_payload = { "likes": new_likes, "created_at": "now()" }
-            existing_source_type = normalize_hall_of_fame_source_type(existing_row.get("source_type"), existing_row.get("doi"))
-
-            if clean_source_type == "doi" and clean_doi and existing_source_type != "doi":
-                update_payload["doi"] = clean_doi[:200]
-                update_payload["source_type"] = "doi"
-            elif existing_row.get("source_type") is None:
-                update_payload["source_type"] = clean_source_type
-
-            update_image_row(str(row_id), update_payload)
-            vote_manager.register_vote(row_id, client_ip)
-            logger.info(f"Image Liked (Bump): {row_id} by {client_ip}") # Audit
-            return {"status": "success", "msg": "Image bumped up!", "likes": new_likes, "id": row_id}
+            if existing_row:
+                row_id = existing_row['id']
+                if await vote_manager.has_voted(row_id, client_ip):
+                      # Return success state but normalized to act like nothing happened
+                     return {"status": "success", "msg": "Already in Hall of Fame!", "likes": existing_row['likes'], "id": row_id}
+
+                new_likes = existing_row['likes'] + 1
+                update_payload = { "likes": new_likes }
+                existing_source_type = normalize_hall_of_fame_source_type(existing_row.get("source_type"), existing_row.get("doi"))
+
+                if clean_source_type == "doi" and clean_doi and existing_source_type != "doi":
+                    update_payload["doi"] = clean_doi[:200]
+                    update_payload["source_type"] = "doi"
+                elif existing_row.get("source_type") is None:
+                    update_payload["source_type"] = clean_source_type
+
+                await repo.update_image(str(row_id), update_payload, touch=True)
+                hall_of_fame.update(img_hash, update_payload, bump=True)
+                await vote_manager.register_vote(row_id, client_ip)
+                logger.info(f"Image Liked (Bump): {row_id} by {client_ip}") # Audit
+                return {"status": "success", "msg": "Image bumped up!", "likes": new_likes, "id": row_id}
         
-        else:
-            # Check Limits (50)
-            count_res = supabase.table("images").select("id", count="exact").execute()
-            current_count = count_res.count if count_res.count is not None else len(count_res.data)
-
-            if current_count >= 50:
-                oldest_res = supabase.table("images").select("id", "storage_path").order("created_at", desc=False).limit(1).execute()
-                if oldest_res.data:
-                    old_node = oldest_res.data[0]
-                    try: supabase.storage.from_("paper_images").remove([old_node['storage_path']])
-                    except: pass
-                    supabase.table("images").delete().eq("id", old_node['id']).execute()
-
-            # Upload
-            file_ext = file.filename.split('.')[-1].lower() if '.' in file.filename else "png"
-            if file_ext not in ['png', 'jpg', 'jpeg', 'gif', 'webp']: file_ext = 'png' # Whitelist
-            storage_path = f"{img_hash}.{file_ext}" # Predictable, collision-safe name? Uses hash, so yes.
+            else:
+                if content is None:
+                    artifact = artifact_store.get(img_hash)
+                    if artifact is None:
+                        # Expired or never extracted here; the client falls back to uploading the file
+                        raise HTTPException(status_code=410, detail="Image expired. Please upload it again.")
+                    content, file_ext = artifact
+                    content_type = "image/jpeg" if file_ext in ("jpg", "jpeg") else f"image/{file_ext}"
+
+                # Upload
+                if file_ext not in ['png', 'jpg', 'jpeg', 'gif', 'webp']: file_ext = 'png' # Whitelist
+                storage_path = f"{img_hash}.{file_ext}" # Predictable, collision-safe name? Uses hash, so yes.
             
-            supabase.storage.from_("paper_images").upload(
-                path=storage_path,
-                file=content,
-                file_options={"content-type": file.content_type}
-            )
+                await repo.upload_blob(storage_path, content, content_type)
             
-            res = insert_image_row({
-                "doi": clean_doi[:200], # Length Limit
-                "source_type": clean_source_type,
-                "image_hash": img_hash,
-                "storage_path": storage_path,
-                "country": country[:10],
-                "likes": 1
-            })
+                new_row = await repo.insert_image({
+                    "doi": clean_doi[:200], # Length Limit
+                    "source_type": clean_source_type,
+                    "image_hash": img_hash,
+                    "storage_path": storage_path,
+                    "country": country[:10],
+                    "likes": 1
+                })
             
-            new_id = res.data[0]['id'] if res.data else None
-            if new_id:
-                vote_manager.register_vote(new_id, client_ip)
-                logger.info(f"Image Uploaded: {new_id} by {client_ip}")
-
-            return {"status": "success", "msg": "Image saved to Hall of Fame", "id": new_id, "likes": 1}
+                new_id = new_row['id'] if new_row else None
+                if new_id:
+                    hall_of_fame.add(new_row)
+                    # Check Limits (50) - only once the new row exists; evict the oldest after responding
+                    for old_node in hall_of_fame.pop_overflow():
+                        background_tasks.add_task(evict_hall_of_fame_row, old_node)
+                    background_tasks.add_task(store_hall_of_fame_variants, new_id, img_hash, content)
+                    await vote_manager.register_vote(new_id, client_ip)
+                    logger.info(f"Image Uploaded: {new_id} by {client_ip}")
+
+                return {"status": "success", "msg": "Image saved to Hall of Fame", "id": new_id, "likes": 1}
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Like Error: {e}")
         raise HTTPException(status_code=500, detail="Internal Error")
 
 @app.post("/api/vote")
 async def vote_image(request: Request, vote: VoteRequest): # Pydantic Modeled
-    if not supabase:
+    if not repo:
         raise HTTPException(status_code=503, detail="Database unavailable")
 
     forwarded = request.headers.get("X-Forwarded-For")
     client_ip = forwarded.split(",")[0] if forwarded else request.client.host
     
-    if vote_manager.has_voted(vote.id, client_ip):
+    if await vote_manager.has_voted(vote.id, client_ip):
          raise HTTPException(status_code=403, detail="Duplicate vote")
     
     try:
-        res = supabase.table("images").select("likes").eq("id", vote.id).execute()
-        if res.data:
-            new_likes = res.data[0]['likes'] + 1
-            supabase.table("images").update({"likes": new_likes}).eq("id", vote.id).execute()
-            vote_manager.register_vote(vote.id, client_ip)
+        row = hall_of_fame.get_by_id(vote.id)
+        if row is None:
+            row = await repo.get_image(vote.id)
+        if row:
+            new_likes = row['likes'] + 1
+            await repo.update_image(vote.id, {"likes": new_likes})
+            if row.get("image_hash"):
+                hall_of_fame.update(row["image_hash"], {"likes": new_likes})
+            await vote_manager.register_vote(vote.id, client_ip)
             logger.info(f"Vote Cast: {vote.id} by {client_ip}")
             return {"status": "success", "likes": new_likes}
         
@@ -727,21 +1254,22 @@ async def vote_image(request: Request, vote: VoteRequest): # Pydantic Modeled
 async def get_trending(period: str = "all"):
     if period not in ["all", "year", "month", "week"]: period = "all" # Validation
 
-    if not supabase:
+    if not repo:
         return {"status": "error", "images": []}
         
     try:
-        query = supabase.table("images").select("*").order("likes", desc=True).limit(50)
         import datetime
         now = datetime.datetime.utcnow()
-        if period == "week": query = query.gte("created_at", (now - datetime.timedelta(days=7)).isoformat())
-        elif period == "month": query = query.gte("created_at", (now - datetime.timedelta(days=30)).isoformat())
-        elif period == "year": query = query.gte("created_at", (now - datetime.timedelta(days=365)).isoformat())
+        since = None
+        if period == "week": since = now - datetime.timedelta(days=7)
+        elif period == "month": since = now - datetime.timedelta(days=30)
+        elif period == "year": since = now - datetime.timedelta(days=365)
             
-        res = query.execute()
+        rows = await repo.top_images(since, 50)
         images = []
-        for row in res.data:
+        for row in rows:
             # No path traversal possibility here as it comes from DB
+            full_url = repo.blob_url(row['storage_path'])
             images.append({
                 "id": row.get("id"),
                 "likes": row.get("likes", 0),
@@ -749,28 +1277,107 @@ async def get_trending(period: str = "all"):
                 "created_at": row.get("created_at"),
                 "doi": normalize_hall_of_fame_doi(row.get("doi")),
                 "source_type": normalize_hall_of_fame_source_type(row.get("source_type"), row.get("doi")),
-                "url": f"{settings.supabase_url}/storage/v1/object/public/paper_images/{row['storage_path']}"
+                "url": full_url,
+                "thumb_url": repo.blob_url(row['thumb_path']) if row.get("thumb_path") else full_url,
+                "preview_url": repo.blob_url(row['preview_path']) if row.get("preview_path") else full_url,
             })
         return {"status": "success", "images": images}
     except Exception as e:
         logger.error(f"Trending Error: {e}")
         return {"status": "error", "detail": f"Database error: {str(e)}", "images": []}
 
+@app.get("/api/chat/history")
+async def get_chat_history(before: Optional[int] = None, limit: int = 30):
+    """Keyset pagination on chats.id: messages with id < before, oldest first."""
+    limit = max(1, min(limit, 100))
+    page = manager.get_history_page(before, limit)
+    if page is None:
+        if not repo:
+            page = [m for m in manager.chat_history if m.get("id") and (before is None or m["id"] < before)][-limit:]
+        else:
+            try:
+                page = list(reversed(await repo.recent_chats(limit, before)))
+            except Exception as e:
+                logger.error(f"Chat History Error: {e}")
+                raise HTTPException(status_code=500, detail="Database error")
+    messages = [{"id": m["id"], "country": m.get("country", "Unknown"), "msg": m.get("msg", "")} for m in page]
+    return {
+        "status": "success",
+        "messages": messages,
+        "next_before": messages[0]["id"] if messages else None,
+        "has_more": len(messages) == limit,
+    }
+
+def _require_admin(request: Request):
+    """Operator-only routes: stack frames, table names and profiles stay off the public API."""
+    token = request.headers.get("X-Admin-Token")
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    if not token and scheme.lower() == "bearer":
+        token = credentials  # What a Prometheus scrape_config's `authorization` block sends
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.get("/api/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Event-loop stalls (with the blocking route/job), DB call latency per table, resolver history per DOI prefix, per-route request memory peaks."""
+    _require_admin(request)
+    return {
+        "status": "success",
+        "loop": loop_monitor.snapshot(),
+        "db": query_stats.snapshot(),
+        "resolvers": resolver_router.snapshot(),
+        "memory": memory_ledger.snapshot(),
+    }
+
+@app.get("/api/admin/profiles", include_in_schema=False)
+async def list_profiles(request: Request):
+    """Recent extraction profiles (X-Profile header or PROFILE_SLOW_SECONDS)."""
+    _require_admin(request)
+    return {"status": "success", "profiles": profile_store.list()}
+
+@app.get("/api/admin/profiles/{profile_id}", include_in_schema=False)
+async def download_profile(profile_id: str, request: Request):
+    """Folded stacks: flamegraph.pl profile.folded > profile.svg, or drop into speedscope."""
+    _require_admin(request)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        profile["folded"],
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'},
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Prometheus text exposition of the histograms/counters in metrics.py (admin token as Bearer)."""
+    _require_admin(request)
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 # Logic Extractor
 IMAGE_EXT_WHITELIST = {"png", "jpeg", "jpg", "gif", "webp"}
 
 
-def _collect_pdf_images(doc: fitz.Document) -> List[Dict]:
+def _collect_pdf_images(doc: fitz.Document, budget: Optional[DocumentBudget] = None) -> List[Dict]:
     images = []
     seen_xrefs = set()
+    budget = budget or DocumentBudget()
 
-    for page_index in range(len(doc)):
+    for page_index in range(budget.pages_allowed(len(doc))):
+        if deadline.exhausted("extract"):
+            logger.warning(f"Deadline reached at page {page_index}/{len(doc)}; returning partial images")
+            break
+        if not budget.allow_page():
+            break
         for img in doc.get_page_images(page_index, full=True):
             xref = img[0]
             if xref in seen_xrefs:
                 continue
 
             seen_xrefs.add(xref)
+            # Reserve against the budget from the image dictionary, before anything is decoded
+            if not budget.allow_image(decoded_size(img[2], img[3], img[4], img[5])):
+                break
 
             try:
                 base_image = doc.extract_image(xref)
@@ -780,9 +1387,13 @@ def _collect_pdf_images(doc: fitz.Document) -> List[Dict]:
                 if not image_bytes or mime not in IMAGE_EXT_WHITELIST:
                     continue
 
-                b64 = base64.b64encode(image_bytes).decode("utf-8")
+                img_hash = hashlib.sha256(image_bytes).hexdigest()
+                artifact_store.put(img_hash, image_bytes, mime)
+                memory_ledger.hold(len(image_bytes))
+
                 images.append({
-                    "base64": f"data:image/{mime};base64,{b64}",
+                    "base64": Base64Blob(image_bytes, f"data:image/{mime};base64,"),
+                    "hash": img_hash,
                     "width": base_image.get("width", 0),
                     "height": base_image.get("height", 0),
                     "size": len(image_bytes),
@@ -794,27 +1405,50 @@ def _collect_pdf_images(doc: fitz.Document) -> List[Dict]:
     return images
 
 
+def _stream_json(result: Dict, profile_id: Optional[str]) -> StreamingResponse:
+    """Extraction result as a streamed JSON body; Base64Blob fields are encoded slice by slice."""
+    headers = {"X-Profile-Id": profile_id} if profile_id else None
+    return StreamingResponse(iter_json(result), media_type="application/json", headers=headers)
+
+
 def extract_from_bytes(pdf_bytes):
     doc = None
     extraction_source = "original"
 
     try:
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            with tracing.span("open"):
+                doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         except Exception as open_error:
             logger.warning(f"Original PDF open failed. Retrying with sanitized PDF: {open_error}")
-            safe_pdf = sanitize_and_compress_pdf(pdf_bytes)
+            # Cheapest tier that yields an openable file: repair, then full scrub. Only a tier that
+            # rejects the file escalates; SanitizeUnavailable (timeout, pool full) ends the attempt
+            for tier in SANITIZE_TIERS:
+                deadline.check("sanitize")
+                safe_pdf = sanitize_pdf(pdf_bytes, tier)
+                if safe_pdf is not None:
+                    break
+            else:
+                raise ValueError("No sanitization tier could recover the PDF")
             doc = fitz.open(stream=safe_pdf, filetype="pdf")
-            extraction_source = "sanitized"
+            extraction_source = "repaired" if tier == "repair" else "sanitized"
 
-        images = _collect_pdf_images(doc)
+        budget = DocumentBudget()
+        with metrics.EXTRACT_SECONDS.time(), tracing.span("extract", f"{len(doc)} pages"):
+            images = _collect_pdf_images(doc, budget)
+        metrics.EXTRACT_IMAGES.observe(len(images))
+        metrics.EXTRACT_BYTES.observe(sum(img["size"] for img in images))
         logger.info(f"Extracted {len(images)} images from {extraction_source} PDF stream")
         return {
             "status": "success",
             "images": images,
             "count": len(images),
             "extraction_source": extraction_source,
+            "budget": budget.report(),
         }
+    except deadline.DeadlineExceeded as e:
+        logger.warning(f"Extraction cut short by the time budget: {e}")
+        return {"status": "timeout", "detail": "Time budget ran out before the PDF could be repaired"}
     except Exception as e:
         logger.error(f"Extraction failed: {e}")
         return {"status": "error", "detail": "Extraction failed"}
@@ -824,6 +1458,9 @@ def extract_from_bytes(pdf_bytes):
 
 # Static Files
 app.mount("/static", StaticFiles(directory="static"), name="static")
+if isinstance(repo, SQLiteRepository):
+    # Hall of Fame images for the local store (Supabase serves its own public URLs)
+    app.mount("/blobs", StaticFiles(directory=repo.blob_dir), name="blobs")
 
 @app.get("/robots.txt", include_in_schema=False)
 async def read_robots():
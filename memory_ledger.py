@@ -0,0 +1,93 @@
+import contextvars
+import resource
+import statistics
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+import metrics
+
+# Per-request accounting of the large buffers a request holds (PDF bytes, image bytes,
+# response chunks). Not a heap profiler: it counts what the code registers, which is where
+# the memory of /api/process and /api/upload goes, and stays cheap enough to leave on.
+RECENT_PEAKS = 200  # Per route, for the p50/p95/max in /api/metrics
+
+
+class Ledger:
+    def __init__(self):
+        self.held = 0
+        self.peak = 0
+        self._lock = threading.Lock()  # Range workers and the response iterator run in other threads
+
+    def hold(self, n: int):
+        with self._lock:
+            self.held += n
+            self.peak = max(self.peak, self.held)
+
+    def release(self, n: int):
+        with self._lock:
+            self.held -= n
+
+
+# Set by MemoryLedgerMiddleware; hold() in threadpool or sanitize-pool work charges this request
+_current: contextvars.ContextVar[Optional[Ledger]] = contextvars.ContextVar("request_ledger", default=None)
+
+_recent: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=RECENT_PEAKS))
+_recent_lock = threading.Lock()
+
+
+def hold(n: int):
+    """Register n bytes held by the current request until it ends; no-op outside a request."""
+    ledger = _current.get()
+    if ledger is not None:
+        ledger.hold(n)
+
+
+def release(n: int):
+    ledger = _current.get()
+    if ledger is not None:
+        ledger.release(n)
+
+
+def snapshot() -> Dict:
+    with _recent_lock:
+        recent = {route: list(peaks) for route, peaks in _recent.items()}
+    routes = {}
+    for route, peaks in recent.items():
+        ordered = sorted(peaks)
+        routes[route] = {
+            "requests": len(ordered),
+            "p50_bytes": int(statistics.median(ordered)),
+            "p95_bytes": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max_bytes": ordered[-1],
+        }
+    # ru_maxrss is KiB on Linux: the process high-water mark to compare the per-request figures with
+    return {"max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, "routes": routes}
+
+
+class MemoryLedgerMiddleware:
+    """ASGI middleware: one Ledger per HTTP request; its peak goes to /metrics and /api/metrics."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        ledger = Ledger()
+        token = _current.set(ledger)
+        state = {"status": None}
+
+        async def watching_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, watching_send)
+        finally:
+            _current.reset(token)
+            if ledger.peak:
+                route = metrics.scope_route(scope, state["status"])
+                metrics.HTTP_REQUEST_PEAK_BYTES.observe(ledger.peak, route=route)
+                with _recent_lock:
+                    _recent[route].append(ledger.peak)
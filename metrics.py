@@ -0,0 +1,267 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Minimal Prometheus text-format (0.0.4) metrics: counters, gauges and histograms with labels.
+# Thread-safe, since extraction and downloads run in the threadpool.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8, 3e8)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+RATE_BUCKETS = (1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 5e7)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for every label set."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float]):
+        """Read the value at scrape time (unlabelled gauges only)."""
+        self._function = fn
+
+    def samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# --- PDF acquisition (utils.get_pdf_from_scihub_advanced) ---
+CROSSREF_SECONDS = histogram("paperprism_crossref_seconds", "Crossref metadata lookup time", ["outcome"])
+MIRROR_ATTEMPT_SECONDS = histogram(
+    "paperprism_mirror_attempt_seconds", "Time spent on one Sci-Hub mirror (page + PDF fetch)", ["mirror", "outcome"]
+)
+PUBLISHER_OA_SECONDS = histogram(
+    "paperprism_publisher_oa_seconds", "Direct publisher open-access attempt time", ["publisher", "outcome"]
+)
+UNPAYWALL_SECONDS = histogram("paperprism_unpaywall_seconds", "Unpaywall fallback time", ["outcome"])
+PDF_DOWNLOAD_SECONDS = histogram("paperprism_pdf_download_seconds", "Final PDF download time", ["source"])
+PDF_DOWNLOAD_BYTES = histogram("paperprism_pdf_download_bytes", "Final PDF download size", ["source"], SIZE_BUCKETS)
+PDF_DOWNLOAD_RATE = histogram(
+    "paperprism_pdf_download_rate_bytes_per_second", "Final PDF download throughput", ["source", "mode"], RATE_BUCKETS
+)
+
+# --- Processing ---
+SANITIZE_SECONDS = histogram("paperprism_sanitize_seconds", "Sanitization time per tier", ["tier", "outcome"])
+SANITIZE_CACHE = counter("paperprism_sanitize_cache_total", "Sanitization lookups: cache hit, new job, shared in-flight job, or rejected (pool full)", ["result"])
+EXTRACT_SECONDS = histogram("paperprism_extract_seconds", "Image collection time per document")
+EXTRACT_IMAGES = histogram("paperprism_extract_images", "Images extracted per document", buckets=COUNT_BUCKETS)
+EXTRACT_BYTES = histogram("paperprism_extract_image_bytes", "Image bytes extracted per document", buckets=SIZE_BUCKETS)
+DOC_BUDGET_EXCEEDED = counter("paperprism_doc_budget_exceeded_total", "Documents stopped by a per-document limit", ["limit"])
+DEADLINE_CUTS = counter("paperprism_deadline_cuts_total", "Stages cut short by the /api/process deadline", ["stage"])
+
+# --- HTTP ---
+HTTP_REQUEST_SECONDS = histogram("paperprism_http_request_seconds", "HTTP request time", ["method", "route", "status"])
+HTTP_RESPONSE_BYTES = histogram("paperprism_http_response_bytes", "HTTP response body size", ["method", "route"], SIZE_BUCKETS)
+HTTP_REQUEST_PEAK_BYTES = histogram(
+    "paperprism_http_request_peak_bytes", "Peak payload bytes held by one request (memory_ledger)", ["route"], SIZE_BUCKETS
+)
+
+# --- WebSocket ---
+WS_CONNECTIONS = gauge("paperprism_ws_connections", "Open WebSocket connections on this worker")
+WS_CONNECTS = counter("paperprism_ws_connects_total", "WebSocket connections accepted")
+WS_EVICTIONS = counter("paperprism_ws_evictions_total", "WebSocket clients dropped for a full send queue")
+WS_BROADCAST_SECONDS = histogram(
+    "paperprism_ws_broadcast_seconds", "Publish to local fan-out complete, per event", ["event"]
+)
+
+# --- Database ---
+DB_QUERY_SECONDS = histogram("paperprism_db_query_seconds", "DB/storage call time", ["table", "op", "outcome"])
+
+# Mounted directories whose paths would otherwise explode label cardinality
+_COLLAPSED_PREFIXES = ("/static/", "/blobs/")
+
+
+def route_label(path: str) -> str:
+    for prefix in _COLLAPSED_PREFIXES:
+        if path.startswith(prefix):
+            return prefix + "*"
+    return path
+
+
+def scope_route(scope, status: Optional[int]) -> str:
+    """Route label for a finished request: the route template, "unmatched", or a collapsed path."""
+    route = scope.get("route")  # Set by FastAPI routing; mounts and 404s have none
+    if getattr(route, "path", None):
+        return route.path
+    if status == 404:
+        return "unmatched"
+    return route_label(scope["path"])
+
+
+class HttpMetricsMiddleware:
+    """ASGI middleware recording request time and response body size per route."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        state = {"status": 500, "bytes": 0}
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            route = scope_route(scope, state["status"])
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route, status=state["status"])
+            HTTP_RESPONSE_BYTES.observe(state["bytes"], method=scope["method"], route=route)
@@ -0,0 +1,129 @@
+import html as html_lib
+import logging
+import re
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger("security_audit")
+
+# Finds the PDF link on a mirror page. Shared by utils.get_pdf_from_scihub_advanced and
+# scihub_api.SciHub. A regex scan over the raw markup handles the known layouts;
+# BeautifulSoup only runs when that finds nothing but the page still hints at a link.
+# Candidates are tried in this order (first match wins):
+#   1. iframe/embed/object with id="pdf"   (src, else data)
+#   2. object whose data contains ".pdf"
+#   3. embed/object with type="application/pdf"
+#   4. <div class="download"> <a href>, then any a[href*="download"], then a[href*=".pdf"]
+#   5. button onclick="location.href='...'"
+
+_COMMENT = re.compile(r"<!--.*?-->", re.S)
+_ATTR = re.compile(r"""([a-zA-Z_:][\w:.-]*)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))""")
+_TAG = {name: re.compile(rf"<{name}\b[^>]*>", re.I) for name in ("iframe", "embed", "object", "a", "button")}
+_DIV_OPEN = re.compile(r"<div\b[^>]*>", re.I)
+_DIV_CLOSE = re.compile(r"</div\s*>", re.I)
+_LOCATION_HREF = re.compile(r"location\.href\s*=\s*['\"]([^'\"]+)['\"]")
+_TITLE = re.compile(r"<title\b[^>]*>(.*?)</title>", re.I | re.S)
+_HINTS = ("<iframe", "<embed", "<object", "download", "location.href", ".pdf")
+
+
+def _decode(page: Union[str, bytes]) -> str:
+    return page.decode("utf-8", errors="replace") if isinstance(page, bytes) else page
+
+
+def _attrs(tag: str) -> Dict[str, str]:
+    attrs = {}
+    for name, dq, sq, bare in _ATTR.findall(tag):
+        attrs.setdefault(name.lower(), html_lib.unescape(dq or sq or bare))
+    return attrs
+
+
+def _tags(markup: str, name: str):
+    for match in _TAG[name].finditer(markup):
+        yield _attrs(match.group(0))
+
+
+def _fast_scan(markup: str) -> Optional[str]:
+    for name in ("iframe", "embed", "object"):
+        for attrs in _tags(markup, name):
+            if attrs.get("id") == "pdf" and (attrs.get("src") or attrs.get("data")):
+                return attrs.get("src") or attrs.get("data")
+    for attrs in _tags(markup, "object"):
+        if ".pdf" in attrs.get("data", ""):
+            return attrs["data"]
+    for name, attr in (("embed", "src"), ("object", "data")):
+        for attrs in _tags(markup, name):
+            if attrs.get("type", "").lower() == "application/pdf" and attrs.get(attr):
+                return attrs[attr]
+    for div in _DIV_OPEN.finditer(markup):
+        # "download" as a whole class token, like the div.download selector
+        if "download" not in div.group(0) or "download" not in _attrs(div.group(0)).get("class", "").split():
+            continue
+        close = _DIV_CLOSE.search(markup, div.end())
+        for attrs in _tags(markup[div.end():close.start() if close else len(markup)], "a"):
+            if attrs.get("href"):
+                return attrs["href"]
+    for needle in ("download", ".pdf"):
+        for attrs in _tags(markup, "a"):
+            if needle in attrs.get("href", ""):
+                return attrs["href"]
+    for attrs in _tags(markup, "button"):
+        match = _LOCATION_HREF.search(attrs.get("onclick", ""))
+        if match:
+            return match.group(1)
+    return None
+
+
+def _soup_scan(markup: str) -> Optional[str]:
+    """Full DOM parse, same rules. Only reached when the regex scan found nothing."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(markup, "html.parser")
+    tag = soup.find("iframe", id="pdf") or soup.find("embed", id="pdf") or soup.find("object", id="pdf")
+    if tag and (tag.get("src") or tag.get("data")):
+        return tag.get("src") or tag.get("data")
+    obj = soup.find("object", data=re.compile(r"\.pdf"))
+    if obj:
+        return obj["data"]
+    for name, attr in (("embed", "src"), ("object", "data")):
+        tag = soup.find(name, type="application/pdf")
+        if tag and tag.get(attr):
+            return tag[attr]
+    link = soup.select_one("div.download a[href]") or soup.select_one('a[href*="download"]') or soup.select_one('a[href*=".pdf"]')
+    if link:
+        return link["href"]
+    for btn in soup.select('button[onclick*="location.href"]'):
+        match = _LOCATION_HREF.search(btn["onclick"])
+        if match:
+            return match.group(1)
+    return None
+
+
+def complete_url(pdf_url: str, base_url: str) -> str:
+    """Make a candidate absolute: protocol-relative -> https, relative -> under the mirror."""
+    if pdf_url.startswith("//"):
+        return "https:" + pdf_url
+    if pdf_url.startswith("http"):
+        return pdf_url
+    base = base_url.rstrip("/")
+    return base + pdf_url if pdf_url.startswith("/") else base + "/" + pdf_url
+
+
+def find_pdf_url(page: Union[str, bytes], base_url: str, allow_fallback: bool = True) -> Optional[str]:
+    """Absolute PDF URL from a mirror page, or None."""
+    markup = _COMMENT.sub("", _decode(page))
+    pdf_url = _fast_scan(markup)
+    if pdf_url is None and allow_fallback and any(hint in markup for hint in _HINTS):
+        try:
+            pdf_url = _soup_scan(markup)
+        except Exception as e:
+            logger.warning(f"PDF link fallback parse failed: {e}")
+        if pdf_url:
+            logger.info("PDF link found by fallback parse only")
+    return complete_url(pdf_url.strip(), base_url) if pdf_url and pdf_url.strip() else None
+
+
+def extract_title(page: Union[str, bytes]) -> Optional[str]:
+    match = _TITLE.search(_decode(page))
+    if not match:
+        return None
+    title = html_lib.unescape(match.group(1)).strip()
+    return title or None
@@ -0,0 +1,184 @@
+import contextvars
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("security_audit")
+
+# Opt-in sampling profiler for the CPU-heavy PDF work (extract_from_bytes / sanitize).
+#   - Per request: send X-Profile: <PROFILE_ADMIN_TOKEN>
+#   - Automatically: any profiled call still running after PROFILE_SLOW_SECONDS starts sampling
+#   - Work handed to another pool (sanitizer) via a copied context runs under followed() and
+#     is sampled too, stacked on top of the caller's wait
+# The last PROFILE_KEEP profiles are kept in memory as folded stacks
+# ("frame;frame;frame <microseconds>"), which flamegraph.pl and speedscope load directly.
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")  # Also X-Admin-Token / Bearer for /api/metrics, /metrics
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "0") or 0)
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_MAX_STACK = 64
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _walk(frame, root_code) -> List[str]:
+    """Frame names from just below root_code down to frame, outermost first."""
+    stack: List[str] = []
+    while frame is not None and frame.f_code is not root_code and len(stack) < PROFILE_MAX_STACK:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples one thread's Python stack until stopped.
+    Each sample is weighted by the wall time since the previous one: a PyMuPDF call that
+    holds the GIL delays the next sample, and that delay is charged to the frame that
+    made the call instead of being lost.
+    """
+    def __init__(self, target_tid: int, root_code, delay: float, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.target_tid = target_tid
+        self.root_code = root_code
+        self.followed: List[int] = []  # Threads running followed() jobs for this call
+        self.delay = delay
+        self.interval = interval
+        self.folded: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._done = threading.Event()
+
+    def run(self):
+        if self.delay and self._done.wait(self.delay):
+            return  # Finished under the threshold: nothing recorded
+        self.started_at = last = time.perf_counter()
+        while not self._done.wait(self.interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            if self.target_tid not in frames:
+                break
+            stack = _walk(frames[self.target_tid], self.root_code)
+            for tid in list(self.followed):
+                if tid in frames:
+                    stack += _walk(frames[tid], _followed_target.__code__)
+            if stack:
+                self.folded[";".join(stack)] += int((now - last) * 1_000_000)
+                self.samples += 1
+            last = now
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class ProfileStore:
+    def __init__(self, keep: int = PROFILE_KEEP):
+        self.keep = keep
+        self._profiles: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: Dict):
+        with self._lock:
+            self._profiles[profile["id"]] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [{k: v for k, v in p.items() if k != "folded"} for p in reversed(self._profiles.values())]
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+
+profile_store = ProfileStore()
+
+
+_active: contextvars.ContextVar[Optional[_Sampler]] = contextvars.ContextVar("profile_sampler", default=None)
+
+
+def _call_target(fn, args, kwargs):
+    # Stack walks stop at this frame, so threadpool internals stay out of the flamegraph
+    return fn(*args, **kwargs)
+
+
+def profile_call(label: str, fn, *args, force: bool = False, **kwargs) -> Tuple[object, Optional[str]]:
+    """
+    Run fn(*args, **kwargs) in the current (worker) thread, sampled if forced or once it
+    runs past PROFILE_SLOW_SECONDS. Returns (result, profile_id or None).
+    """
+    if not force and not PROFILE_SLOW_SECONDS:
+        return fn(*args, **kwargs), None
+    sampler = _Sampler(
+        threading.get_ident(),
+        _call_target.__code__,
+        delay=0 if force else PROFILE_SLOW_SECONDS,
+        interval=PROFILE_INTERVAL_SECONDS,
+    )
+    start = time.perf_counter()
+    sampler.start()
+    token = _active.set(sampler)
+    try:
+        return _call_target(fn, args, kwargs), _finish(label, sampler, start, force)
+    except BaseException:
+        _finish(label, sampler, start, force)
+        raise
+    finally:
+        _active.reset(token)
+
+
+def _followed_target(fn, args):
+    # Stack walks of a followed thread stop at this frame
+    return fn(*args)
+
+
+def followed(fn, *args):
+    """
+    Run a job submitted from a profiled call (inside a copy of its context) so the sampler
+    also walks this thread; without an active profile it is a plain call.
+    """
+    sampler = _active.get()
+    if sampler is None:
+        return fn(*args)
+    tid = threading.get_ident()
+    sampler.followed.append(tid)
+    try:
+        return _followed_target(fn, args)
+    finally:
+        sampler.followed.remove(tid)
+
+
+def _finish(label: str, sampler: _Sampler, start: float, forced: bool) -> Optional[str]:
+    sampler.stop()
+    if not sampler.samples:
+        return None
+    profile_id = uuid.uuid4().hex[:12]
+    wall = time.perf_counter() - start
+    profile_store.add({
+        "id": profile_id,
+        "label": label,
+        "trigger": "header" if forced else "slow",
+        "created_at": time.time(),
+        "wall_seconds": round(wall, 3),
+        "sampled_seconds": round(wall - (sampler.started_at - start), 3),
+        "samples": sampler.samples,
+        "folded": "\n".join(f"{stack} {weight}" for stack, weight in sampler.folded.most_common()) + "\n",
+    })
+    logger.info(f"Profile captured: {profile_id} ({label}, {wall:.2f}s, {sampler.samples} samples)")
+    return profile_id
@@ -0,0 +1,501 @@
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from db import execute, run_db
+
+logger = logging.getLogger("security_audit")
+
+STORAGE_BUCKET = "paper_images"
+
+# Columns added by later migrations; Supabase writes retry without them on older schemas
+OPTIONAL_IMAGE_COLUMNS = ("source_type", "thumb_path", "preview_path")
+
+
+def should_retry_without_column(error: Exception, column: str) -> bool:
+    message = str(error).lower()
+    return column in message and (
+        "column" in message
+        or "schema cache" in message
+        or "could not find" in message
+        or "does not exist" in message
+    )
+
+
+def should_fall_back_without_function(error: Exception, function: str) -> bool:
+    message = str(error).lower()
+    return function in message and (
+        "pgrst202" in message
+        or "schema cache" in message
+        or "could not find" in message
+        or "does not exist" in message
+    )
+
+
+def _strip_missing_columns(payload: Dict, error: Exception) -> Optional[Dict]:
+    missing = [c for c in OPTIONAL_IMAGE_COLUMNS if c in payload and should_retry_without_column(error, c)]
+    if not missing:
+        return None
+    return {k: v for k, v in payload.items() if k not in missing}
+
+
+class Repository(ABC):
+    """
+    Everything the app persists: Hall of Fame images + blobs, votes, chats, leaderboard.
+    All methods are coroutines; implementations run their blocking I/O through db.run_db.
+    Rows are plain dicts using the Supabase column names.
+    """
+    name = "base"
+
+    # images
+    @abstractmethod
+    async def list_images(self) -> List[Dict]:
+        """All rows, oldest created_at first."""
+
+    @abstractmethod
+    async def get_image(self, image_id) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def find_image_by_hash(self, image_hash: str) -> Optional[Dict]:
+        """The row for an image hash, whichever worker inserted it."""
+
+    @abstractmethod
+    async def top_images(self, since: Optional[datetime.datetime], limit: int) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    async def insert_image(self, payload: Dict) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def update_image(self, image_id, payload: Dict, touch: bool = False):
+        """touch=True also resets created_at to now (a bump)."""
+
+    @abstractmethod
+    async def delete_image(self, image_id):
+        ...
+
+    # blobs
+    @abstractmethod
+    async def upload_blob(self, path: str, data: bytes, content_type: str, upsert: bool = False):
+        ...
+
+    @abstractmethod
+    async def remove_blobs(self, paths: List[str]):
+        ...
+
+    @abstractmethod
+    def blob_url(self, path: str) -> str:
+        ...
+
+    # votes
+    @abstractmethod
+    async def has_vote(self, image_id, ip_hash: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def add_vote(self, image_id, ip_hash: str):
+        ...
+
+    # chats
+    @abstractmethod
+    async def insert_chats(self, rows: List[Dict]) -> List[int]:
+        """Returns the new ids in insert order."""
+
+    @abstractmethod
+    async def recent_chats(self, limit: int, before: Optional[int] = None) -> List[Dict]:
+        """Newest first, optionally only ids < before."""
+
+    @abstractmethod
+    async def count_chats(self) -> int:
+        ...
+
+    @abstractmethod
+    async def chat_id_at_offset(self, offset: int) -> Optional[int]:
+        """id of the chat `offset` rows below the newest one."""
+
+    @abstractmethod
+    async def delete_chats_before(self, chat_id: int):
+        ...
+
+    # leaderboard
+    @abstractmethod
+    async def top_leaderboard(self, limit: int) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    async def apply_leaderboard_increments(self, increments: Dict[str, Tuple[int, int]]):
+        """country -> (score_inc, chat_inc)"""
+
+
+class SupabaseRepository(Repository):
+    name = "supabase"
+
+    def __init__(self, client, base_url: str):
+        self.client = client
+        self.base_url = base_url
+        self.increment_rpc = True  # Off once the database turns out to predate the migration
+
+    async def list_images(self) -> List[Dict]:
+        res = await execute(self.client.table("images").select("*").order("created_at", desc=False), "images.select")
+        return res.data
+
+    async def get_image(self, image_id) -> Optional[Dict]:
+        res = await execute(self.client.table("images").select("*").eq("id", image_id), "images.select")
+        return res.data[0] if res.data else None
+
+    async def find_image_by_hash(self, image_hash):
+        res = await execute(self.client.table("images").select("*").eq("image_hash", image_hash).limit(1), "images.select")
+        return res.data[0] if res.data else None
+
+    async def top_images(self, since, limit):
+        query = self.client.table("images").select("*").order("likes", desc=True).limit(limit)
+        if since is not None:
+            query = query.gte("created_at", since.isoformat())
+        res = await execute(query, "images.select")
+        return res.data
+
+    async def insert_image(self, payload):
+        try:
+            res = await execute(self.client.table("images").insert(payload), "images.insert")
+        except Exception as exc:
+            fallback = _strip_missing_columns(payload, exc)
+            if fallback is None:
+                raise
+            res = await execute(self.client.table("images").insert(fallback), "images.insert")
+        return res.data[0] if res.data else None
+
+    async def update_image(self, image_id, payload, touch=False):
+        if touch:
+            payload = {**payload, "created_at": "now()"}
+        try:
+            await execute(self.client.table("images").update(payload).eq("id", image_id), "images.update")
+        except Exception as exc:
+            fallback = _strip_missing_columns(payload, exc)
+            if fallback is None:
+                raise
+            if fallback:
+                await execute(self.client.table("images").update(fallback).eq("id", image_id), "images.update")
+
+    async def delete_image(self, image_id):
+        await execute(self.client.table("images").delete().eq("id", image_id), "images.delete")
+
+    async def upload_blob(self, path, data, content_type, upsert=False):
+        options = {"content-type": content_type}
+        if upsert:
+            options["upsert"] = "true"
+        await run_db("storage.upload", self.client.storage.from_(STORAGE_BUCKET).upload, path=path, file=data, file_options=options)
+
+    async def remove_blobs(self, paths):
+        await run_db("storage.remove", self.client.storage.from_(STORAGE_BUCKET).remove, paths)
+
+    def blob_url(self, path):
+        return f"{self.base_url}/storage/v1/object/public/{STORAGE_BUCKET}/{path}"
+
+    async def has_vote(self, image_id, ip_hash):
+        res = await execute(self.client.table("votes").select("id").eq("image_id", image_id).eq("ip_hash", ip_hash), "votes.select")
+        return bool(res.data)
+
+    async def add_vote(self, image_id, ip_hash):
+        await execute(self.client.table("votes").insert({"image_id": image_id, "ip_hash": ip_hash}), "votes.insert")
+
+    async def insert_chats(self, rows):
+        res = await execute(self.client.table("chats").insert(rows), "chats.insert")
+        return [row["id"] for row in res.data]
+
+    async def recent_chats(self, limit, before=None):
+        query = self.client.table("chats").select("id", "country", "msg").order("id", desc=True).limit(limit)
+        if before is not None:
+            query = query.lt("id", before)
+        res = await execute(query, "chats.select")
+        return res.data
+
+    async def count_chats(self):
+        res = await execute(self.client.table("chats").select("id", count="exact", head=True), "chats.count")
+        return res.count or 0
+
+    async def chat_id_at_offset(self, offset):
+        res = await execute(self.client.table("chats").select("id").order("id", desc=True).range(offset, offset).limit(1), "chats.select")
+        return res.data[0]["id"] if res.data else None
+
+    async def delete_chats_before(self, chat_id):
+        await execute(self.client.table("chats").delete().lt("id", chat_id), "chats.delete", timeout=120)
+
+    async def top_leaderboard(self, limit):
+        res = await execute(self.client.table("leaderboard").select("*").order("score", desc=True).limit(limit), "leaderboard.select")
+        return res.data
+
+    async def apply_leaderboard_increments(self, increments):
+        if self.increment_rpc:
+            # Server-side "score = score + n" (leaderboard_increment_migration.sql), so concurrent workers don't lose updates
+            payload = {country: [score_inc, chat_inc] for country, (score_inc, chat_inc) in increments.items()}
+            try:
+                await execute(self.client.rpc("apply_leaderboard_increments", {"increments": payload}), "leaderboard.rpc")
+                return
+            except Exception as exc:
+                if not should_fall_back_without_function(exc, "apply_leaderboard_increments"):
+                    raise
+                self.increment_rpc = False
+                logger.error(
+                    "Supabase: apply_leaderboard_increments() is missing; run leaderboard_increment_migration.sql. "
+                    "Falling back to read+upsert, which can lose updates between workers"
+                )
+
+        # Older schema: read current totals once, then upsert them all
+        res = await execute(self.client.table("leaderboard").select("*").in_("country", list(increments)), "leaderboard.select")
+        current = {row["country"]: row for row in res.data}
+        rows = []
+        for country, (score_inc, chat_inc) in increments.items():
+            curr = current.get(country, {})
+            rows.append({
+                "country": country,
+                "score": (curr.get("score") or 0) + score_inc,
+                "chat_count": (curr.get("chat_count") or 0) + chat_inc,
+            })
+        await execute(self.client.table("leaderboard").upsert(rows, on_conflict="country"), "leaderboard.upsert")
+
+SQLITE_SCHEMA = """
+create table if not exists images (
+  id integer primary key autoincrement,
+  doi text,
+  source_type text,
+  image_hash text,
+  storage_path text,
+  thumb_path text,
+  preview_path text,
+  country text,
+  likes integer default 0,
+  created_at text not null
+);
+create index if not exists images_hash_idx on images (image_hash);
+create index if not exists images_likes_idx on images (likes);
+
+create table if not exists votes (
+  id integer primary key autoincrement,
+  image_id integer not null,
+  ip_hash text not null,
+  created_at text not null
+);
+create index if not exists votes_image_ip_idx on votes (image_id, ip_hash);
+
+create table if not exists chats (
+  id integer primary key autoincrement,
+  country text,
+  msg text,
+  created_at text not null
+);
+
+create table if not exists leaderboard (
+  country text primary key,
+  score integer default 0,
+  chat_count integer default 0
+);
+"""
+
+IMAGE_COLUMNS = ("doi", "source_type", "image_hash", "storage_path", "thumb_path", "preview_path", "country", "likes", "created_at")
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class SQLiteRepository(Repository):
+    """
+    Single-node backend: SQLite in WAL mode for rows, plain files for blobs
+    (served by the app under /blobs). One connection per DB-pool thread.
+    """
+    name = "sqlite"
+
+    def __init__(self, data_dir: str, blob_url_prefix: str = "/blobs"):
+        self.data_dir = os.path.abspath(data_dir)
+        self.blob_dir = os.path.join(self.data_dir, "blobs")
+        self.db_path = os.path.join(self.data_dir, "paper_prism.db")
+        self.blob_url_prefix = blob_url_prefix
+        self._local = threading.local()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SQLITE_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.execute("pragma busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql: str, params=()) -> List[Dict]:
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def _write(self, sql: str, params=()) -> int:
+        conn = self._conn()
+        with conn:
+            return conn.execute(sql, params).lastrowid
+
+    async def _run(self, label: str, fn, *args):
+        return await run_db(label, fn, *args)
+
+    # images
+    async def list_images(self):
+        return await self._run("images.select", self._query, "select * from images order by created_at asc")
+
+    async def get_image(self, image_id):
+        rows = await self._run("images.select", self._query, "select * from images where id = ?", (image_id,))
+        return rows[0] if rows else None
+
+    async def find_image_by_hash(self, image_hash):
+        rows = await self._run("images.select", self._query, "select * from images where image_hash = ? limit 1", (image_hash,))
+        return rows[0] if rows else None
+
+    async def top_images(self, since, limit):
+        if since is None:
+            return await self._run("images.select", self._query, "select * from images order by likes desc limit ?", (limit,))
+        since = since.replace(tzinfo=since.tzinfo or datetime.timezone.utc).isoformat()
+        return await self._run(
+            "images.select", self._query,
+            "select * from images where created_at >= ? order by likes desc limit ?", (since, limit)
+        )
+
+    def _insert_image(self, payload):
+        row = {k: payload.get(k) for k in IMAGE_COLUMNS}
+        row["created_at"] = _now()
+        cols = ", ".join(row)
+        marks = ", ".join("?" for _ in row)
+        new_id = self._write(f"insert into images ({cols}) values ({marks})", tuple(row.values()))
+        return {"id": new_id, **row}
+
+    async def insert_image(self, payload):
+        return await self._run("images.insert", self._insert_image, payload)
+
+    async def update_image(self, image_id, payload, touch=False):
+        fields = {k: v for k, v in payload.items() if k in IMAGE_COLUMNS}
+        if touch:
+            fields["created_at"] = _now()
+        if not fields:
+            return
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        await self._run("images.update", self._write, f"update images set {assignments} where id = ?", (*fields.values(), image_id))
+
+    async def delete_image(self, image_id):
+        await self._run("images.delete", self._write, "delete from images where id = ?", (image_id,))
+
+    # blobs
+    def _blob_path(self, path: str) -> str:
+        full = os.path.abspath(os.path.join(self.blob_dir, path))
+        if not full.startswith(self.blob_dir + os.sep):
+            raise ValueError("Invalid blob path")
+        return full
+
+    def _write_blob(self, path, data, upsert):
+        full = self._blob_path(path)
+        if os.path.exists(full) and not upsert:
+            raise FileExistsError(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        tmp = f"{full}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, full)
+
+    def _remove_blobs(self, paths):
+        for path in paths:
+            try:
+                os.remove(self._blob_path(path))
+            except FileNotFoundError:
+                pass
+
+    async def upload_blob(self, path, data, content_type, upsert=False):
+        await self._run("storage.upload", self._write_blob, path, data, upsert)
+
+    async def remove_blobs(self, paths):
+        await self._run("storage.remove", self._remove_blobs, paths)
+
+    def blob_url(self, path):
+        return f"{self.blob_url_prefix}/{path}"
+
+    # votes
+    async def has_vote(self, image_id, ip_hash):
+        rows = await self._run(
+            "votes.select", self._query,
+            "select id from votes where image_id = ? and ip_hash = ? limit 1", (image_id, ip_hash)
+        )
+        return bool(rows)
+
+    async def add_vote(self, image_id, ip_hash):
+        await self._run(
+            "votes.insert", self._write,
+            "insert into votes (image_id, ip_hash, created_at) values (?, ?, ?)", (image_id, ip_hash, _now())
+        )
+
+    # chats
+    def _insert_chats(self, rows):
+        conn = self._conn()
+        now = _now()
+        ids = []
+        with conn:
+            for row in rows:
+                cur = conn.execute(
+                    "insert into chats (country, msg, created_at) values (?, ?, ?)",
+                    (row.get("country"), row.get("msg"), now)
+                )
+                ids.append(cur.lastrowid)
+        return ids
+
+    async def insert_chats(self, rows):
+        return await self._run("chats.insert", self._insert_chats, rows)
+
+    async def recent_chats(self, limit, before=None):
+        if before is None:
+            return await self._run("chats.select", self._query, "select id, country, msg from chats order by id desc limit ?", (limit,))
+        return await self._run(
+            "chats.select", self._query,
+            "select id, country, msg from chats where id < ? order by id desc limit ?", (before, limit)
+        )
+
+    async def count_chats(self):
+        rows = await self._run("chats.count", self._query, "select count(*) as n from chats")
+        return rows[0]["n"]
+
+    async def chat_id_at_offset(self, offset):
+        rows = await self._run("chats.select", self._query, "select id from chats order by id desc limit 1 offset ?", (offset,))
+        return rows[0]["id"] if rows else None
+
+    async def delete_chats_before(self, chat_id):
+        await self._run("chats.delete", self._write, "delete from chats where id < ?", (chat_id,))
+
+    # leaderboard
+    async def top_leaderboard(self, limit):
+        return await self._run("leaderboard.select", self._query, "select * from leaderboard order by score desc limit ?", (limit,))
+
+    def _apply_increments(self, increments):
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "insert into leaderboard (country, score, chat_count) values (?, ?, ?) "
+                "on conflict(country) do update set score = score + excluded.score, chat_count = chat_count + excluded.chat_count",
+                [(country, score_inc, chat_inc) for country, (score_inc, chat_inc) in increments.items()]
+            )
+
+    async def apply_leaderboard_increments(self, increments):
+        await self._run("leaderboard.upsert", self._apply_increments, increments)
+
+
+def create_repository(supabase_client, supabase_url: Optional[str], data_dir: str) -> Optional[Repository]:
+    """Supabase when configured, otherwise a local SQLite store under data_dir."""
+    if supabase_client is not None:
+        return SupabaseRepository(supabase_client, supabase_url)
+    try:
+        repo = SQLiteRepository(data_dir)
+        logger.info(f"Persistence: Using local SQLite store at {repo.db_path}")
+        return repo
+    except Exception as e:
+        logger.error(f"Local store init failed: {e}")
+        return None
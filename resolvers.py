@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+import deadline
+import metrics
+import tracing
+from downloader import download, get_body
+from pdf_link import find_pdf_url, extract_title
+
+logger = logging.getLogger("security_audit")
+
+# Upstreams (overridable so benchmarks/loadtest.py can point them at local stand-ins)
+DEFAULT_SCIHUB_MIRRORS = [
+    "https://sci-hub.hlgczx.com",
+    "https://sci-hub.st",
+    "https://sci-hub.se",
+    "https://sci-hub.ru",
+    "https://sci-hub.do",
+    "https://www.sci-hub.in"
+]
+SCIHUB_MIRRORS = [m.strip().rstrip("/") for m in os.getenv("SCIHUB_MIRRORS", "").split(",") if m.strip()] or DEFAULT_SCIHUB_MIRRORS
+UNPAYWALL_API_URL = os.getenv("UNPAYWALL_API_URL", "https://api.unpaywall.org").rstrip("/")
+DOI_RESOLVER_URL = os.getenv("DOI_RESOLVER_URL", "https://doi.org").rstrip("/")
+
+# Learned routing: per DOI prefix, which resolver delivered and how fast (optional JSON persistence)
+RESOLVER_STATS_PATH = os.getenv("RESOLVER_STATS_PATH")
+ROUTING_DEMOTE_AFTER = 3       # Failures with no success before a resolver drops to the back
+ROUTING_HISTORY_CAP = 50       # Per-prefix counts are halved past this so old history fades
+ROUTING_EWMA_ALPHA = 0.3
+ROUTING_SAVE_INTERVAL = 30
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'
+}
+
+
+@dataclass
+class Resolution:
+    content: bytes
+    title: Optional[str] = None  # Used only when Crossref had no title
+
+
+def fetch_pdf(url: str, timeout: float, source: str, span_desc: Optional[str] = None) -> Optional[bytes]:
+    """GET a PDF (ranged in parallel when large); None unless it is a 200 that starts like a PDF."""
+    start = time.perf_counter()
+    result = download(url, HEADERS, deadline.timeout(timeout, "download"))
+    if result.status == 200 and b'%PDF' in result.content[:100]:
+        mode = "ranged" if result.connections > 1 else "single"
+        rate_desc = f"{result.rate / 1e6:.2f} MB/s x{result.connections}"
+        tracing.observe_stage(metrics.PDF_DOWNLOAD_SECONDS, "download", start, desc=f"{span_desc or source} {rate_desc}", source=source)
+        metrics.PDF_DOWNLOAD_BYTES.observe(len(result.content), source=source)
+        metrics.PDF_DOWNLOAD_RATE.observe(result.rate, source=source, mode=mode)
+        logger.info(f"Downloaded {len(result.content) / 1e6:.1f}MB in {result.seconds:.1f}s ({rate_desc})")
+        return result.content
+    logger.warning(f"Response not a valid PDF or status {result.status}")
+    return None
+
+
+class Resolver(ABC):
+    """One way of turning a DOI into PDF bytes. resolve() is blocking (runs in the threadpool)."""
+    name = "resolver"
+
+    def applies(self, doi: str) -> bool:
+        return True
+
+    @abstractmethod
+    def resolve(self, doi: str) -> Optional[Resolution]:
+        """PDF bytes (+ title if the source has one), or None to try the next resolver."""
+
+
+class MirrorResolver(Resolver):
+    def __init__(self, mirror: str):
+        self.mirror = mirror
+        self.name = f"mirror:{urlparse(mirror).netloc}"
+
+    def resolve(self, doi):
+        target_url = f"{self.mirror}/{doi}"
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            logger.info(f"Checking mirror: {target_url}")
+            status, page = get_body(target_url, 10, "mirror", headers=HEADERS, verify=False)
+            logger.info(f"Mirror {self.mirror} returned status: {status}")
+            outcome = f"http_{status}"
+            if status != 200:
+                return None
+            pdf_url = find_pdf_url(page, self.mirror)
+            if not pdf_url:
+                outcome = "no_link"
+                logger.warning(f"No PDF URL found on page for {self.mirror}")
+                return None
+            logger.info(f"Fetching final PDF: {pdf_url}")
+            content = fetch_pdf(pdf_url, timeout=25, source="mirror", span_desc=urlparse(self.mirror).netloc)
+            if content is None:
+                outcome = "bad_pdf"
+                return None
+            outcome = "pdf"
+            page_title = extract_title(page)
+            return Resolution(content, page_title.split('|')[0] if page_title else None)
+        except deadline.DeadlineExceeded:
+            outcome = "deadline"
+            return None
+        except Exception as e:
+            logger.warning(f"Request to {self.mirror} failed: {e}")
+            return None
+        finally:
+            tracing.observe_stage(
+                metrics.MIRROR_ATTEMPT_SECONDS, "mirror", start,
+                desc=f"{urlparse(self.mirror).netloc} {outcome}", mirror=self.mirror, outcome=outcome
+            )
+
+
+class UnpaywallResolver(Resolver):
+    name = "unpaywall"
+
+    def resolve(self, doi):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            status, body = get_body(f"{UNPAYWALL_API_URL}/v2/{doi}?email=unpaywall@impactstory.org", 5, "unpaywall")
+            outcome = "miss"
+            if status != 200:
+                return None
+            oa_data = json.loads(body)
+            best_loc = oa_data.get('best_oa_location')
+            if not best_loc or not best_loc.get('url_for_pdf'):
+                return None
+            pdf_url = best_loc['url_for_pdf']
+            logger.info(f"Trying OA link: {pdf_url}")
+            content = fetch_pdf(pdf_url, timeout=20, source="unpaywall")
+            if content is None:
+                return None
+            outcome = "pdf"
+            return Resolution(content, oa_data.get('title') or 'paper')
+        except deadline.DeadlineExceeded:
+            outcome = "deadline"
+            return None
+        except Exception as e:
+            logger.warning(f"Unpaywall failed: {e}")
+            return None
+        finally:
+            tracing.observe_stage(metrics.UNPAYWALL_SECONDS, "unpaywall", start, desc=outcome, outcome=outcome)
+
+
+def _landing_url(doi: str) -> Optional[str]:
+    """Follow the DOI resolver to the publisher's article page."""
+    res = requests.head(f"{DOI_RESOLVER_URL}/{doi}", headers=HEADERS, allow_redirects=True, timeout=deadline.timeout(5, "publisher"))
+    return res.url.rstrip("/") if res.status_code < 400 else None
+
+
+_PLOS_JOURNALS = {
+    "pone": "plosone", "pbio": "plosbiology", "pmed": "plosmedicine", "pcbi": "ploscompbiol",
+    "pgen": "plosgenetics", "ppat": "plospathogens", "pntd": "plosntds",
+}
+
+
+def _arxiv_pdf(doi: str) -> Optional[str]:
+    match = re.search(r"arxiv\.(.+)$", doi, re.I)
+    return f"https://arxiv.org/pdf/{match.group(1)}" if match else None
+
+
+def _plos_pdf(doi: str) -> Optional[str]:
+    match = re.match(r"10\.1371/journal\.([a-z]+)\.", doi, re.I)
+    journal = _PLOS_JOURNALS.get(match.group(1).lower()) if match else None
+    return f"https://journals.plos.org/{journal}/article/file?id={doi}&type=printable" if journal else None
+
+
+def _landing_suffix(suffix: str) -> Callable[[str], Optional[str]]:
+    def build(doi: str) -> Optional[str]:
+        landing = _landing_url(doi)
+        return landing + suffix if landing else None
+    return build
+
+
+class PublisherOAResolver(Resolver):
+    """Direct PDF URL for open-access publishers whose links follow from the DOI."""
+    def __init__(self, publisher: str, prefixes: Tuple[str, ...], build_url: Callable[[str], Optional[str]]):
+        self.name = f"publisher:{publisher}"
+        self.publisher = publisher
+        self.prefixes = prefixes
+        self.build_url = build_url
+
+    def applies(self, doi):
+        return doi.lower().startswith(self.prefixes)
+
+    def resolve(self, doi):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            pdf_url = self.build_url(doi)
+            if not pdf_url:
+                outcome = "no_link"
+                return None
+            logger.info(f"Trying {self.publisher} OA link: {pdf_url}")
+            content = fetch_pdf(pdf_url, timeout=20, source="publisher", span_desc=self.publisher)
+            outcome = "pdf" if content else "bad_pdf"
+            return Resolution(content) if content else None
+        except deadline.DeadlineExceeded:
+            outcome = "deadline"
+            return None
+        except Exception as e:
+            logger.warning(f"{self.publisher} OA failed: {e}")
+            return None
+        finally:
+            tracing.observe_stage(metrics.PUBLISHER_OA_SECONDS, "publisher", start, desc=f"{self.publisher} {outcome}", publisher=self.publisher, outcome=outcome)
+
+
+PUBLISHER_RESOLVERS = [
+    PublisherOAResolver("arxiv", ("10.48550/",), _arxiv_pdf),
+    PublisherOAResolver("plos", ("10.1371/journal.",), _plos_pdf),
+    PublisherOAResolver("mdpi", ("10.3390/",), _landing_suffix("/pdf")),
+    PublisherOAResolver("biorxiv", ("10.1101/",), _landing_suffix(".full.pdf")),
+]
+
+# Default order: a matching publisher pattern, then the mirrors, then Unpaywall
+RESOLVERS: List[Resolver] = [*PUBLISHER_RESOLVERS, *(MirrorResolver(m) for m in SCIHUB_MIRRORS), UnpaywallResolver()]
+
+
+def doi_prefix(doi: str) -> str:
+    """Registrant prefix ("10.1371"): the unit routing history is kept for."""
+    return doi.split("/", 1)[0].lower()
+
+
+class ResolverRouter:
+    """
+    Per-prefix history of resolver outcomes, used to reorder the pipeline.
+    Resolvers that have delivered for a prefix go first, cheapest expected cost first
+    (EWMA success latency / success rate). Untried ones keep their default order, and
+    ones that keep failing there move to the back.
+    """
+    def __init__(self, path: Optional[str] = RESOLVER_STATS_PATH):
+        self.path = path
+        self._stats: Dict[str, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._load()
+
+    def record(self, prefix: str, resolver: str, ok: bool, seconds: float):
+        with self._lock:
+            stat = self._stats.setdefault(prefix, {}).setdefault(resolver, {"ok": 0, "fail": 0, "ewma_s": None})
+            if ok:
+                stat["ok"] += 1
+                prev = stat["ewma_s"]
+                stat["ewma_s"] = seconds if prev is None else ROUTING_EWMA_ALPHA * seconds + (1 - ROUTING_EWMA_ALPHA) * prev
+            else:
+                stat["fail"] += 1
+            if stat["ok"] + stat["fail"] > ROUTING_HISTORY_CAP:
+                stat["ok"] //= 2
+                stat["fail"] //= 2
+        self._maybe_save()
+
+    def order(self, prefix: str, resolvers: List[Resolver]) -> List[Resolver]:
+        with self._lock:
+            stats = {k: dict(v) for k, v in self._stats.get(prefix, {}).items()}
+        proven, untried, failing = [], [], []
+        for resolver in resolvers:
+            stat = stats.get(resolver.name)
+            if stat and stat["ok"]:
+                rate = stat["ok"] / (stat["ok"] + stat["fail"])
+                proven.append((stat["ewma_s"] / rate, resolver))
+            elif stat and stat["fail"] >= ROUTING_DEMOTE_AFTER:
+                failing.append(resolver)
+            else:
+                untried.append(resolver)
+        proven.sort(key=lambda item: item[0])
+        return [r for _, r in proven] + untried + failing
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {prefix: {k: dict(v) for k, v in stats.items()} for prefix, stats in self._stats.items()}
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self._stats = json.load(f)
+        except Exception as e:
+            logger.warning(f"Resolver stats load failed: {e}")
+
+    def _maybe_save(self):
+        if not self.path or time.time() - self._last_save < ROUTING_SAVE_INTERVAL:
+            return
+        self._last_save = time.time()
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Resolver stats save failed: {e}")
+
+
+router = ResolverRouter()
+
+
+def resolve_pdf(doi: str) -> Tuple[Optional[Resolution], Optional[str]]:
+    """Try resolvers in learned order. Returns (resolution, resolver name) or (None, None)."""
+    prefix = doi_prefix(doi)
+    for resolver in router.order(prefix, [r for r in RESOLVERS if r.applies(doi)]):
+        if deadline.exhausted("resolve"):
+            break
+        start = time.perf_counter()
+        result = resolver.resolve(doi)
+        if result is None and deadline.exhausted("resolve"):
+            break  # Out of budget, not evidence against this resolver
+        router.record(prefix, resolver.name, result is not None, time.perf_counter() - start)
+        if result is not None:
+            logger.info(f"Resolved {doi} via {resolver.name}")
+            return result, resolver.name
+    return None, None
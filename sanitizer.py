@@ -0,0 +1,201 @@
+import contextvars
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Dict, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+import deadline
+import metrics
+import profiler
+import tracing
+from doc_budget import sanitize_refusal
+from downloader import MAX_PDF_SIZE
+
+logger = logging.getLogger("security_audit")
+
+# Two tiers, cheapest first:
+#   repair - trim junk around the PDF and let MuPDF rebuild the xref; streams are copied as-is
+#   full   - scrub (JS, embedded files, metadata) + garbage=4/deflate/clean rewrite
+# Runs on its own small pool under a timeout, and results (failures included) are cached by
+# input hash, so a file that needed repair once, or a hostile one, costs the CPU only once.
+SANITIZE_TIERS = ("repair", "full")
+SANITIZE_TIMEOUT_SECONDS = float(os.getenv("SANITIZE_TIMEOUT_SECONDS", "20"))
+SANITIZE_WORKERS = int(os.getenv("SANITIZE_WORKERS", "2"))
+SANITIZE_QUEUE = int(os.getenv("SANITIZE_QUEUE", "4"))  # Jobs allowed to wait for a worker
+SANITIZE_CACHE_MAX_BYTES = int(os.getenv("SANITIZE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SANITIZE_CACHE_MAX_ENTRIES = 1024
+
+# MuPDF cannot be interrupted, so a timed-out job that already started keeps its worker until it
+# returns; one still queued is cancelled. At most SANITIZE_WORKERS + SANITIZE_QUEUE jobs are
+# admitted at once; past that sanitize_pdf refuses instead of growing the executor's queue.
+sanitize_pool = ThreadPoolExecutor(max_workers=SANITIZE_WORKERS, thread_name_prefix="sanitize")
+_slots = threading.BoundedSemaphore(SANITIZE_WORKERS + SANITIZE_QUEUE)
+
+_PDF_HEADER = b"%PDF-"
+_PDF_EOF = b"%%EOF"
+
+
+def _trim(pdf_bytes: bytes) -> bytes:
+    """Drop bytes before the header (HTML preambles from mirrors) and after the last %%EOF."""
+    start = pdf_bytes.find(_PDF_HEADER, 0, 1024)
+    if start < 0:
+        raise ValueError("No PDF header")
+    end = pdf_bytes.rfind(_PDF_EOF)
+    if end > start:
+        return pdf_bytes[start:end + len(_PDF_EOF)]
+    return pdf_bytes[start:] if start else pdf_bytes
+
+
+def _check_rewrite_budget(doc):
+    """Resource Limit: a rewrite (tobytes) is unbounded on huge page/object counts."""
+    refusal = sanitize_refusal(len(doc), doc.xref_length())
+    if refusal:
+        metrics.DOC_BUDGET_EXCEEDED.inc(limit="sanitize")
+        raise ValueError(f"Over budget: {refusal}")
+
+
+def repair_pdf(pdf_bytes: bytes) -> bytes:
+    """Cheap tier: enough to make a broken file open for extraction. Raises if it cannot."""
+    trimmed = _trim(pdf_bytes)
+    doc = fitz.open(stream=trimmed, filetype="pdf")
+    try:
+        if doc.page_count == 0:
+            raise ValueError("No pages after repair")
+        if not doc.is_repaired:
+            return trimmed  # Trimming was enough
+        _check_rewrite_budget(doc)  # A rebuilt file is rewritten whole
+        return doc.tobytes(garbage=1)  # Fresh xref, no recompression
+    finally:
+        doc.close()
+
+
+def scrub_pdf(pdf_bytes: bytes) -> bytes:
+    """Full tier: remove active content and rewrite the whole file. Raises if it cannot."""
+    doc = fitz.open(stream=_trim(pdf_bytes), filetype="pdf")
+    try:
+        _check_rewrite_budget(doc)
+
+        # Security: Remove JS, embedded files, annotations, and form fields
+        doc.scrub(
+            attached_files=True,
+            clean_pages=True,
+            embedded_files=True,
+            javascript=True,
+            hidden_text=False, # Keep text for reading
+            xml_metadata=True # Remove potentially sensitive metadata
+        )
+        return doc.tobytes(garbage=4, deflate=True, clean=True)
+    finally:
+        doc.close()
+
+
+_TIER_FUNCTIONS = {"repair": repair_pdf, "full": scrub_pdf}
+
+
+class SanitizeUnavailable(Exception):
+    """The job timed out or the pool was full: a costlier tier would not fare better."""
+
+
+class SanitizeCache:
+    """LRU of (input sha256, tier) -> output bytes, or None for inputs the tier could not handle."""
+    def __init__(self, max_bytes: int = SANITIZE_CACHE_MAX_BYTES, max_entries: int = SANITIZE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Tuple[str, str], Optional[bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Tuple[bool, Optional[bytes]]:
+        with self._lock:
+            if key not in self._items:
+                return False, None
+            self._items.move_to_end(key)
+            return True, self._items[key]
+
+    def put(self, key: Tuple[str, str], value: Optional[bytes]):
+        size = len(value) if value else 0
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                old = self._items.pop(key)
+                self._bytes -= len(old) if old else 0
+            self._items[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._items) > self.max_entries:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= len(old) if old else 0
+
+
+sanitize_cache = SanitizeCache()
+_inflight: Dict[Tuple[str, str], Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _run(key: Tuple[str, str], pdf_bytes: bytes) -> Optional[bytes]:
+    tier = key[1]
+    start = time.perf_counter()
+    try:
+        result = _TIER_FUNCTIONS[tier](pdf_bytes)
+        tracing.observe_stage(metrics.SANITIZE_SECONDS, "sanitize", start, desc=tier, tier=tier, outcome="ok")
+    except Exception as e:
+        result = None
+        tracing.observe_stage(metrics.SANITIZE_SECONDS, "sanitize", start, desc=f"{tier} failed", tier=tier, outcome="error")
+        logger.warning(f"Sanitization ({tier}) failed: {e}")
+    sanitize_cache.put(key, result)  # Also when the caller has already timed out
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    return result
+
+
+def sanitize_pdf(pdf_bytes: bytes, tier: str = "repair") -> Optional[bytes]:
+    """
+    Run one tier on the sanitize pool, waiting at most SANITIZE_TIMEOUT_SECONDS (or what is
+    left of the request deadline). Returns the output, or None if the tier cannot handle the
+    file; raises SanitizeUnavailable on timeout or when the pool is full, and DeadlineExceeded
+    when it was the request budget that ran out. Identical concurrent inputs share one job.
+    """
+    if len(pdf_bytes) > MAX_PDF_SIZE:
+        raise ValueError("PDF Bomb Prevention: File too large")
+
+    key = (hashlib.sha256(pdf_bytes).hexdigest(), tier)
+    hit, value = sanitize_cache.get(key)
+    if hit:
+        metrics.SANITIZE_CACHE.inc(result="hit")
+        tracing.record("sanitize", 0, f"{tier} cached")
+        return value
+
+    wait = deadline.timeout(SANITIZE_TIMEOUT_SECONDS, "sanitize")
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            metrics.SANITIZE_CACHE.inc(result="shared")
+        elif not _slots.acquire(blocking=False):
+            metrics.SANITIZE_CACHE.inc(result="rejected")
+            raise SanitizeUnavailable("Sanitize pool is full")
+        else:
+            metrics.SANITIZE_CACHE.inc(result="miss")
+            # Copied context: spans, the request deadline/ledger and an active profile follow the job
+            future = sanitize_pool.submit(contextvars.copy_context().run, profiler.followed, _run, key, pdf_bytes)
+            future.add_done_callback(lambda _: _slots.release())  # Also runs when cancelled
+            _inflight[key] = future
+
+    try:
+        return future.result(timeout=wait)
+    except (FuturesTimeout, CancelledError):
+        metrics.SANITIZE_SECONDS.observe(wait, tier=tier, outcome="timeout")
+        if future.cancel():
+            with _inflight_lock:
+                if _inflight.get(key) is future:
+                    del _inflight[key]
+            logger.warning(f"Sanitization ({tier}) timed out before it started; cancelled")
+        else:
+            logger.warning(f"Sanitization ({tier}) timed out; job left to finish in the background")
+        deadline.check("sanitize")
+        raise SanitizeUnavailable(f"Sanitization ({tier}) timed out")
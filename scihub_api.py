@@ -1,5 +1,5 @@
 import requests
-from bs4 import BeautifulSoup
+from pdf_link import find_pdf_url
 import random
 import time
 
@@ -18,69 +18,7 @@ class SciHub:
         }
 
     def _get_pdf_url(self, html_content, base_url):
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Method 1: Check for iframe
-        iframe = soup.find('iframe', {'id': 'pdf'})
-        if iframe and iframe.get('src'):
-            src = iframe.get('src')
-            if src.startswith('//'):
-                return 'https:' + src
-            if src.startswith('/'):
-                return base_url + src
-            return src
-
-        # Method 2: Check for embed
-        embed = soup.find('embed', {'type': 'application/pdf'})
-        if embed and embed.get('src'):
-            src = embed.get('src')
-            if src.startswith('//'):
-                return 'https:' + src
-            if src.startswith('/'):
-                return base_url + src
-            return src
-            
-        # Method 3: Check for object tag (common in other mirrors)
-        obj = soup.find('object', {'type': 'application/pdf'})
-        if obj and obj.get('data'):
-            src = obj.get('data')
-            if src.startswith('//'):
-                return 'https:' + src
-            if src.startswith('/'):
-                return base_url + src
-            return src
-            
-        # Method 4: Check for download link (div class="download" -> a href)
-        download_div = soup.find('div', {'class': 'download'})
-        if download_div:
-            link = download_div.find('a')
-            if link and link.get('href'):
-                src = link.get('href')
-                if src.startswith('//'):
-                    return 'https:' + src
-                if src.startswith('/'):
-                    return base_url + src
-                return src
-
-        # Method 5: specific button (onclick location.href)
-        buttons = soup.find_all('button')
-        for btn in buttons:
-            onclick = btn.get('onclick')
-            if onclick and 'location.href' in onclick:
-                try:
-                    start_quote = onclick.find("'")
-                    end_quote = onclick.find("'", start_quote + 1)
-                    if start_quote != -1 and end_quote != -1:
-                        src = onclick[start_quote+1:end_quote]
-                        if src.startswith('//'):
-                            return 'https:' + src
-                        if src.startswith('/'):
-                            return base_url + src
-                        return src
-                except:
-                    continue
-        
-        return None
+        return find_pdf_url(html_content, base_url)
 
     def fetch_pdf(self, doi):
         """
@@ -120,7 +58,7 @@ class SciHub:
                 if response.status_code != 200:
                     continue
 
-                pdf_url = self._get_pdf_url(response.text, mirror)
+                pdf_url = self._get_pdf_url(response.content, mirror)
                 
                 if not pdf_url:
                     print(f"PDF URL not found on {mirror}")
@@ -14,6 +14,9 @@ const App = {
         debounceTimer: null,
         // Chat State
         ws: null,
+        leaderboard: [], // Local copy, patched by 'leaderboard_delta' ticks
+        chatBefore: null, // Keyset cursor for older chat history (null = nothing older)
+        chatHistoryLoading: false,
         myCountry: 'UN',
         chatOpen: false,
         unread: 0,
@@ -777,6 +780,14 @@ const App = {
             input.addEventListener('keypress', (e) => { if (e.key === 'Enter') send(); });
         }
 
+        // Load older chat history when scrolled to the top
+        const chatMessages = document.getElementById('chatMessages');
+        if (chatMessages) {
+            chatMessages.addEventListener('scroll', () => {
+                if (chatMessages.scrollTop < 40) this.loadOlderChatHistory();
+            });
+        }
+
         // Bind Social Tabs
         const tabBtns = document.querySelectorAll('.tab-btn');
         tabBtns.forEach(btn => {
@@ -904,10 +915,11 @@ const App = {
             // Image
             // Use cached public URL or construct it
             const imgUrl = img.url || img.base64; // Fallback? api/trending should return url
+            const thumbUrl = img.thumb_url || imgUrl; // Small WebP variant for the grid
 
             item.innerHTML = `
                 ${rankHtml}
-                <img src="${imgUrl}" loading="lazy" alt="Trending">
+                <img src="${thumbUrl}" loading="lazy" decoding="async" alt="Trending">
             `;
 
             // DOI Pill (Smart Extraction Button) - Restored and Improved
@@ -972,27 +984,42 @@ const App = {
 
         this.showStatus('Adding to Hall of Fame...', 'normal');
 
-        // Convert Base64 -> Blob -> File
-        try {
-            const fetchRes = await fetch(img.base64);
-            const blob = await fetchRes.blob();
-
-            // Fix MIME type and filename
-            let mimeType = `image/${img.ext}`;
-            if (img.ext === 'jpg' || img.ext === 'jpeg') mimeType = 'image/jpeg';
-
-            const file = new File([blob], `image.${img.ext}`, { type: mimeType });
-
+        const buildForm = () => {
             const formData = new FormData();
-            formData.append('file', file);
             formData.append('doi', this.state.currentDoi || '');
             formData.append('source_type', this.state.currentSourceType || 'pdf_upload');
             formData.append('country', this.state.myCountry);
+            return formData;
+        };
 
-            const res = await fetch('/api/like', {
-                method: 'POST',
-                body: formData
-            });
+        try {
+            let res = null;
+
+            // 1. Like-by-reference: the server still holds the bytes from extraction
+            if (img.hash) {
+                const formData = buildForm();
+                formData.append('image_hash', img.hash);
+                res = await fetch('/api/like', { method: 'POST', body: formData });
+            }
+
+            // 2. Fallback: Convert Base64 -> Blob -> File and upload it
+            if (!res || res.status === 410 || res.status === 400) {
+                const fetchRes = await fetch(img.base64);
+                const blob = await fetchRes.blob();
+
+                // Fix MIME type and filename
+                let mimeType = `image/${img.ext}`;
+                if (img.ext === 'jpg' || img.ext === 'jpeg') mimeType = 'image/jpeg';
+
+                const file = new File([blob], `image.${img.ext}`, { type: mimeType });
+
+                const formData = buildForm();
+                formData.append('file', file);
+                res = await fetch('/api/like', {
+                    method: 'POST',
+                    body: formData
+                });
+            }
             const data = await res.json();
             console.log("Like Result:", data);
 
@@ -1027,7 +1054,8 @@ const App = {
 
     connectWS() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
+        // Leaderboard arrives as deltas; events use the compact array encoding (plain JSON objects still understood)
+        const wsUrl = `${protocol}//${window.location.host}/ws?lb=delta&enc=compact`;
         console.log("Connecting to WS:", wsUrl);
 
         this.state.ws = new WebSocket(wsUrl);
@@ -1040,7 +1068,8 @@ const App = {
         };
 
         this.state.ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+            let data = JSON.parse(event.data);
+            if (Array.isArray(data)) data = this.decodeCompactEvent(data);
             if (data.type === 'chat') {
                 this.renderChatMessage(data);
                 if (!this.state.chatOpen) {
@@ -1048,11 +1077,17 @@ const App = {
                     this.updateChatBadge();
                 }
             } else if (data.type === 'init') {
+                this.state.leaderboard = Array.isArray(data.leaderboard) ? data.leaderboard : [];
                 this.renderLeaderboard(data.leaderboard);
-                // Restore History
+                // Restore History (recent tail only; older pages load on scroll)
+                const msgs = document.getElementById('chatMessages');
+                if (msgs) msgs.innerHTML = '';
                 if (data.history && Array.isArray(data.history)) {
                     data.history.forEach(msg => this.renderChatMessage(msg));
                 }
+                this.state.chatBefore = data.history_before ?? null;
+            } else if (data.type === 'leaderboard_delta') {
+                this.applyLeaderboardDelta(data.entries, data.removed);
             } else if (data.type === 'update_score') {
                 if (data.leaderboard) this.renderLeaderboard(data.leaderboard);
             } else if (data.type === 'online_count') {
@@ -1078,6 +1113,23 @@ const App = {
         };
     },
 
+    // Inverse of ws_protocol.to_compact on the server
+    decodeCompactEvent(arr) {
+        const rows = (list) => (list || []).map(([country, score, chats]) => ({ country, score, chats }));
+        switch (arr[0]) {
+            case 'c': return { type: 'chat', country: arr[1], msg: arr[2], leaderboard: arr[3] ? rows(arr[3]) : undefined };
+            case 's': return { type: 'update_score', country: arr[1], leaderboard: arr[2] ? rows(arr[2]) : undefined };
+            case 'd': return { type: 'leaderboard_delta', entries: rows(arr[1]), removed: arr[2] };
+            case 'o': return { type: 'online_count', count: arr[1], distribution: arr[2] };
+            case 'i': return {
+                type: 'init', online: arr[1], leaderboard: rows(arr[2]),
+                history: (arr[3] || []).map(([country, msg]) => ({ type: 'chat', country, msg })),
+                history_before: arr[4]
+            };
+            default: return {};
+        }
+    },
+
     updateConnectionStatus(status) {
         const dot = document.getElementById('connectionStatus');
         const input = document.getElementById('chatInput');
@@ -1141,10 +1193,31 @@ const App = {
         return `<img src="https://flagcdn.com/w40/${code}.png" srcset="https://flagcdn.com/w80/${code}.png 2x" width="20" alt="${countryCode}" style="vertical-align: middle; border-radius: 2px;">`;
     },
 
-    renderChatMessage(data) {
-        const msgs = document.getElementById('chatMessages');
-        if (!msgs) return;
+    async loadOlderChatHistory() {
+        if (this.state.chatHistoryLoading || this.state.chatBefore == null) return;
+        this.state.chatHistoryLoading = true;
+        try {
+            const res = await fetch(`/api/chat/history?before=${this.state.chatBefore}&limit=30`);
+            const data = await res.json();
+            if (data.status !== 'success') return;
+
+            const msgs = document.getElementById('chatMessages');
+            if (msgs && data.messages.length) {
+                // Prepend while keeping the current view anchored
+                const prevHeight = msgs.scrollHeight;
+                const first = msgs.firstChild;
+                data.messages.forEach(msg => msgs.insertBefore(this.buildChatRow(msg), first));
+                msgs.scrollTop += msgs.scrollHeight - prevHeight;
+            }
+            this.state.chatBefore = data.has_more ? data.next_before : null;
+        } catch (e) {
+            console.warn('Chat history load failed', e);
+        } finally {
+            this.state.chatHistoryLoading = false;
+        }
+    },
 
+    buildChatRow(data) {
         const row = document.createElement('div');
         row.className = `msg-row`;
         const flagHtml = this.getFlagEmoji(data.country); // Now returns <img>
@@ -1154,13 +1227,29 @@ const App = {
         });
 
         row.innerHTML = `<div class="msg-flag" title="${data.country}">${flagHtml}</div><div class="msg-bubble">${safeMsg}</div>`;
-        msgs.appendChild(row);
+        return row;
+    },
+
+    renderChatMessage(data) {
+        const msgs = document.getElementById('chatMessages');
+        if (!msgs) return;
+
+        msgs.appendChild(this.buildChatRow(data));
         msgs.scrollTop = msgs.scrollHeight;
     },
 
     // ... (Skipping getFlagEmoji definition since we replaced it above or defining it here if it was separate) ...
     // Note: In Previous code getFlagEmoji was below renderChatMessage. I will replace both in one block to be safe.
 
+    applyLeaderboardDelta(entries, removed) {
+        if (!Array.isArray(entries)) return;
+        const board = new Map(this.state.leaderboard.map(item => [item.country, item]));
+        entries.forEach(item => board.set(item.country, item));
+        (removed || []).forEach(country => board.delete(country));
+        this.state.leaderboard = [...board.values()].sort((a, b) => b.score - a.score);
+        this.renderLeaderboard(this.state.leaderboard);
+    },
+
     renderLeaderboard(board) {
         const el = document.getElementById('leaderboard');
         if (!el) return;
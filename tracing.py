@@ -0,0 +1,96 @@
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("security_audit")
+
+# Requests slower than this get one JSON log line with their span breakdown (unset = off)
+SLOW_REQUEST_LOG_SECONDS = float(os.getenv("SLOW_REQUEST_LOG_SECONDS", "0") or 0)
+MAX_SPANS = 64  # Server-Timing header stays small even if a loop records many spans
+
+# Spans of the current request. The list object is shared with threadpool work
+# (run_in_threadpool copies the context), so spans recorded in utils.py land here too.
+_spans: contextvars.ContextVar[Optional[List[Dict]]] = contextvars.ContextVar("request_spans", default=None)
+
+
+def record(name: str, seconds: float, desc: Optional[str] = None):
+    """Add a finished span to the current request; no-op outside a request."""
+    spans = _spans.get()
+    if spans is None or len(spans) >= MAX_SPANS:
+        return
+    span = {"name": name, "ms": round(seconds * 1000, 1)}
+    if desc:
+        span["desc"] = desc
+    spans.append(span)
+
+
+def observe_stage(histogram, span_name: str, start: float, desc: Optional[str] = None, **labels):
+    """Record one pipeline stage in a /metrics histogram and as a span of the current request."""
+    elapsed = time.perf_counter() - start
+    histogram.observe(elapsed, **labels)
+    record(span_name, elapsed, desc)
+
+
+@contextmanager
+def span(name: str, desc: Optional[str] = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, desc)
+
+
+def _server_timing(spans: List[Dict], total_ms: float) -> str:
+    parts = []
+    for s in spans:
+        part = s["name"]
+        if s.get("desc"):
+            part += ';desc="' + s["desc"].replace('"', "'").replace("\\", "/") + '"'
+        parts.append(f"{part};dur={s['ms']}")
+    parts.append(f"total;dur={total_ms}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware: collects spans for each HTTP request, returns them as a
+    Server-Timing header and optionally logs slow requests as JSON.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        spans: List[Dict] = []
+        token = _spans.set(spans)
+        start = time.perf_counter()
+        state = {"status": None}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                total_ms = round((time.perf_counter() - start) * 1000, 1)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(spans, total_ms).encode("latin-1", "replace")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _spans.reset(token)
+            elapsed = time.perf_counter() - start
+            if SLOW_REQUEST_LOG_SECONDS and elapsed >= SLOW_REQUEST_LOG_SECONDS:
+                logger.warning(json.dumps({
+                    "event": "slow_request",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": state["status"],
+                    "total_ms": round(elapsed * 1000, 1),
+                    "spans": spans,
+                }))
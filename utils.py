@@ -1,10 +1,16 @@
 import fitz  # PyMuPDF
-import re
 import requests
-from bs4 import BeautifulSoup
 import urllib3
 from urllib.parse import urlparse
+import json
 import logging
+import os
+import time
+
+import metrics
+import tracing
+from downloader import MAX_PDF_SIZE, get_body
+from resolvers import resolve_pdf
 
 # Security Logger
 logger = logging.getLogger("security_audit")
@@ -12,7 +18,7 @@ logger = logging.getLogger("security_audit")
 # Suppress SSL warnings (Risk Accepted for Sci-Hub functionality)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-MAX_PDF_SIZE = 300 * 1024 * 1024  # 300MB Limit to Prevent DoS
+CROSSREF_API_URL = os.getenv("CROSSREF_API_URL", "https://api.crossref.org").rstrip("/")
 
 def sanitize_filename(title: str) -> str:
     """Sanitize the paper title for use as a filename."""
@@ -66,36 +72,6 @@ def safe_download(url: str, timeout=30) -> bytes:
         
         return content
 
-def sanitize_and_compress_pdf(pdf_bytes: bytes) -> bytes:
-    """
-    Load PDF, clean malicious scripts/embedded files, and compress it.
-    Returns the sanitized PDF bytes safe for client consumption.
-    """
-    if len(pdf_bytes) > MAX_PDF_SIZE:
-         raise ValueError("PDF Bomb Prevention: File too large")
-
-    try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        # Security: Remove JS, embedded files, annotations, and form fields
-        doc.scrub(
-            attached_files=True, 
-            clean_pages=True, 
-            embedded_files=True, 
-            javascript=True,
-            hidden_text=False, # Keep text for reading
-            xml_metadata=True # Remove potentially sensitive metadata
-        )
-        
-        sanitized_bytes = doc.tobytes(garbage=4, deflate=True, clean=True)
-        doc.close()
-        return sanitized_bytes
-    except Exception as e:
-        logger.warning(f"Sanitization Warning: {e}")
-        # Build valid PDF from scratch if corrupt? No, return as is but warn.
-        # In Strict Security, we should reject. Here for usability, we return.
-        return pdf_bytes
-
 def extract_images_from_pdf_bytes(pdf_bytes: bytes) -> list:
     """
     Extracts images from PDF bytes using PyMuPDF.
@@ -143,28 +119,15 @@ def extract_images_from_pdf_bytes(pdf_bytes: bytes) -> list:
 
 def get_pdf_from_scihub_advanced(doi: str):
     """
-    Attempts to fetch PDF from Sci-Hub mirrors or Open Access links.
+    Attempts to fetch PDF via the resolver pipeline (publisher OA links, Sci-Hub mirrors, Unpaywall).
     Also fetches metadata from Crossref.
     Returns: (bytes, title, paper_info_dict) OR (None, error_msg, paper_info_dict)
     """
-    mirrors = [
-        "https://sci-hub.hlgczx.com",
-        "https://sci-hub.st",
-        "https://sci-hub.se",
-        "https://sci-hub.ru",
-        "https://sci-hub.do",
-        "https://www.sci-hub.in"
-    ]
-    
     clean_doi = doi.strip()
     # Basic normalization if not already handled
     if 'doi.org/' in clean_doi:
         clean_doi = clean_doi.split('doi.org/')[-1]
     
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'
-    }
-
     paper_info = {
         "title": "Unknown Paper",
         "journal": "",
@@ -173,11 +136,14 @@ def get_pdf_from_scihub_advanced(doi: str):
     }
 
     # 0. Quick Metadata Fetch (Crossref)
+    cr_start = time.perf_counter()
+    cr_outcome = "error"
     try:
-        cr_url = f"https://api.crossref.org/works/{clean_doi}"
-        cr_res = requests.get(cr_url, timeout=3) # Fast timeout
-        if cr_res.status_code == 200:
-            data = cr_res.json()['message']
+        cr_url = f"{CROSSREF_API_URL}/works/{clean_doi}"
+        cr_status, cr_body = get_body(cr_url, 3, "crossref") # Fast timeout
+        cr_outcome = "ok" if cr_status == 200 else "miss"
+        if cr_status == 200:
+            data = json.loads(cr_body)['message']
             paper_info['title'] = data.get('title', ['Unknown Paper'])[0]
             if 'short-container-title' in data and data['short-container-title']:
                 paper_info['journal'] = data['short-container-title'][0]
@@ -197,89 +163,13 @@ def get_pdf_from_scihub_advanced(doi: str):
             logger.info(f"Metadata Found: {paper_info['title']}")
     except:
         pass
-
-    # 1. Try Mirrors
-    for mirror in mirrors:
-        target_url = f"{mirror}/{clean_doi}"
-        try:
-            logger.info(f"Checking mirror: {target_url}")
-            res = requests.get(target_url, headers=headers, timeout=10, verify=False)
-            logger.info(f"Mirror {mirror} returned status: {res.status_code}")
-            
-            if res.status_code == 200:
-                soup = BeautifulSoup(res.content, 'html.parser')
-                pdf_url = None
-                
-                # 1. Try iframe or embed (Classic Sci-Hub)
-                iframe = soup.find('iframe', id='pdf') or soup.find('embed', id='pdf') or soup.find('object', id='pdf')
-                if iframe and iframe.get('src'):
-                    pdf_url = iframe['src']
-                elif iframe and iframe.get('data'):
-                    pdf_url = iframe['data']
-                
-                # 2. Try object tag specifically (Newer mirrors)
-                if not pdf_url:
-                    obj = soup.find('object', data=re.compile(r'\.pdf'))
-                    if obj:
-                        pdf_url = obj['data']
-                
-                # 3. Try direct download link (e.g., div.download a)
-                if not pdf_url:
-                    download_link = soup.select_one('div.download a[href]') or soup.select_one('a[href*="download"]') or soup.select_one('a[href*=".pdf"]')
-                    if download_link:
-                        pdf_url = download_link['href']
-
-                # 4. Try button with location.href
-                if not pdf_url:
-                    btn = soup.select_one('button[onclick*="location.href"]')
-                    if btn:
-                        match = re.search(r"location\.href='([^']+)'", btn['onclick'])
-                        if match: pdf_url = match.group(1)
-                
-                if pdf_url:
-                    logger.info(f"Detected PDF URL candidate: {pdf_url}")
-                    # Robust URL completion
-                    if pdf_url.startswith('//'):
-                        pdf_url = 'https:' + pdf_url
-                    elif not pdf_url.startswith('http'):
-                        # Handle relative paths properly
-                        base_mirror = mirror.rstrip('/')
-                        if pdf_url.startswith('/'):
-                            pdf_url = base_mirror + pdf_url
-                        else:
-                            pdf_url = base_mirror + '/' + pdf_url
-                    
-                    logger.info(f"Fetching final PDF: {pdf_url}")
-                    pdf_res = requests.get(pdf_url, headers=headers, timeout=25, verify=False)
-                    if pdf_res.status_code == 200 and b'%PDF' in pdf_res.content[:100]:
-                        try:
-                            if soup.title and paper_info['title'] == "Unknown Paper":
-                                paper_info['title'] = sanitize_filename(soup.title.string.split('|')[0])
-                        except: pass
-                        return pdf_res.content, paper_info['title'], paper_info
-                    else:
-                        logger.warning(f"Response not a valid PDF or status {pdf_res.status_code}")
-                        pdf_url = None # Reset to try next pattern/mirror
-                else:
-                    logger.warning(f"No PDF URL found in soup for {mirror}")
-        except Exception as e:
-            logger.warning(f"Request to {mirror} failed: {e}")
-            continue
-    
-    # 2. Try Unpaywall (Open Access)
-    try:
-        oa_res = requests.get(f"https://api.unpaywall.org/v2/{clean_doi}?email=unpaywall@impactstory.org", timeout=5)
-        if oa_res.status_code == 200:
-            oa_data = oa_res.json()
-            best_loc = oa_data.get('best_oa_location')
-            if best_loc and best_loc.get('url_for_pdf'):
-                pdf_url = best_loc['url_for_pdf']
-                logger.info(f"Trying OA link: {pdf_url}")
-                oa_pdf_res = requests.get(pdf_url, headers=headers, timeout=20, verify=False)
-                if b'%PDF' in oa_pdf_res.content[:100]:
-                    if paper_info['title'] == "Unknown Paper": paper_info['title'] = sanitize_filename(oa_data.get('title', 'paper'))
-                    return oa_pdf_res.content, paper_info['title'], paper_info
-    except Exception as e:
-        logger.warning(f"Unpaywall failed: {e}")
+    tracing.observe_stage(metrics.CROSSREF_SECONDS, "crossref", cr_start, outcome=cr_outcome)
+
+    # 1. Resolver pipeline: publisher OA patterns, mirrors, Unpaywall (order learned per DOI prefix)
+    resolution, resolver_name = resolve_pdf(clean_doi)
+    if resolution is not None:
+        if resolution.title and paper_info['title'] == "Unknown Paper":
+            paper_info['title'] = sanitize_filename(resolution.title)
+        return resolution.content, paper_info['title'], paper_info
 
     return None, "PDF not found on Sci-Hub mirrors or Open Access.", paper_info
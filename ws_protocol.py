@@ -0,0 +1,62 @@
+import json
+from typing import Dict, List
+
+# /ws wire encodings.
+#   "json":    one JSON object per event (original protocol, default)
+#   "compact": one JSON array per event, positional fields, single-letter tags.
+#              Drops the repeated "type"/"country"/"leaderboard" keys; decoded by app_v10.js.
+ENCODING_JSON = "json"
+ENCODING_COMPACT = "compact"
+COMPACT_SUBPROTOCOL = "pp.compact.v1"
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+def _board_rows(board: List[Dict]) -> List[list]:
+    return [[item["country"], item["score"], item["chats"]] for item in board]
+
+def to_compact(message: Dict):
+    """
+    Map an event dict to its positional form:
+      init:             ["i", online, [[country, score, chats], ...], [[country, msg], ...], history_before]
+      chat:             ["c", country, msg]            (+ board rows for full-board clients)
+      update_score:     ["s", country]                 (+ board rows for full-board clients)
+      leaderboard_delta:["d", [[country, score, chats], ...]]   (+ [removed countries] when any)
+      online_count:     ["o", count, distribution]
+    Unknown events are sent unchanged as objects.
+    """
+    t = message.get("type")
+    if t == "chat":
+        out = ["c", message.get("country"), message.get("msg")]
+    elif t == "update_score":
+        out = ["s", message.get("country")]
+    elif t == "leaderboard_delta":
+        out = ["d", _board_rows(message["entries"])]
+        if message.get("removed"):
+            out.append(message["removed"])
+        return out
+    elif t == "online_count":
+        return ["o", message.get("count"), message.get("distribution")]
+    elif t == "init":
+        return [
+            "i",
+            message.get("online"),
+            _board_rows(message.get("leaderboard", [])),
+            [[m.get("country"), m.get("msg")] for m in message.get("history", [])],
+            message.get("history_before"),
+        ]
+    else:
+        return message
+    if "leaderboard" in message:
+        out.append(_board_rows(message["leaderboard"]))
+    return out
+
+def encode_message(message: Dict, encoding: str) -> str:
+    if encoding == ENCODING_COMPACT:
+        return _dumps(to_compact(message))
+    return _dumps(message)
+
+def negotiate_encoding(query_value, subprotocols) -> str:
+    if query_value == ENCODING_COMPACT or COMPACT_SUBPROTOCOL in (subprotocols or []):
+        return ENCODING_COMPACT
+    return ENCODING_JSON